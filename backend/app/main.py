@@ -2,38 +2,58 @@ from __future__ import annotations
 
 import asyncio
 import base64
-import html
+import copy
+import hashlib
 import io
 import json
+import math
 import os
 import re
+import shutil
+import sys
+import threading
 import time
 import unicodedata
 import uuid
 import urllib.request
 import zipfile
-from collections import defaultdict
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from enum import Enum
+from itertools import groupby
+from operator import attrgetter
 from pathlib import Path
-from typing import Annotated, AsyncGenerator, Literal
+from typing import (
+    Annotated,
+    AsyncGenerator,
+    BinaryIO,
+    Callable,
+    Hashable,
+    Iterator,
+    Literal,
+    TYPE_CHECKING,
+    Sequence,
+    TypeVar,
+)
 from urllib.parse import quote
 
-import mammoth
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString, Tag
-from docx import Document
-from docx.shared import Pt
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Tag
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from lxml import etree
+from lxml.html import document_fromstring
+import orjson
 from pydantic import BaseModel
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
+from rapidfuzz.distance import Indel
+
+# mammoth、python-docx、reportlab 只在对应的转换/导出路径中按需导入，缩短进程启动时间
+if TYPE_CHECKING:
+    from docx.document import Document as DocxDocument
 
-app = FastAPI(title="Word to Tiptap Converter")
+app = FastAPI(title="Word to Tiptap Converter", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "ETag", "X-Sanitized-Hits"],
 )
 
 STYLE_MAP = """
@@ -55,12 +76,17 @@ r[style-name='Strong'] => strong
 r[style-name='Emphasis'] => em
 """
 
-SUPPORTED_MIME_TYPES = {
-    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    "application/octet-stream",  # some browsers fallback
-}
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+SUPPORTED_MIME_TYPES = frozenset(
+    {
+        DOCX_MEDIA_TYPE,
+        "application/octet-stream",  # some browsers fallback
+    }
+)
 
 WORD_FILE_MIME_TYPES = SUPPORTED_MIME_TYPES | {"application/msword"}
+WORD_FILE_SUFFIXES = frozenset({".docx", ".doc"})
 
 BASE_DIR = Path(__file__).resolve().parent
 ONLYOFFICE_STORAGE_DIR = BASE_DIR / "storage" / "onlyoffice"
@@ -161,26 +187,51 @@ class AiAction(str, Enum):
     CUSTOM = "custom"
 
 
-def _format_sse(*, data: str, event: str | None = None, event_id: str | None = None) -> str:
+def _format_sse(*, payload: object, event: str | None = None, event_id: str | None = None) -> bytes:
     """Format payload in SSE wire format."""
 
-    lines: list[str] = []
+    # orjson 输出为紧凑单行 UTF-8（字符串内换行均被转义），可直接作为唯一的 data 行
+    head = ""
     if event_id:
-        lines.append(f"id: {event_id}")
+        head += f"id: {event_id}\n"
     if event:
-        lines.append(f"event: {event}")
-    payload_lines = data.splitlines() or [""]
-    lines.extend(f"data: {line}" for line in payload_lines)
-    lines.append("")
-    return "\n".join(lines)
+        head += f"event: {event}\n"
+    return b"".join((head.encode("utf-8"), b"data: ", orjson.dumps(payload), b"\n\n"))
+
+
+AI_STREAM_CHUNK_SIZE = 48
+AI_STREAM_CHUNK_DELAY = 0.18
 
 
-def _chunk_text(text: str, chunk_size: int = 48) -> list[str]:
-    """Split text into balanced chunks for streaming."""
+def _chunk_count(text: str, chunk_size: int = AI_STREAM_CHUNK_SIZE) -> int:
+    if chunk_size <= 0:
+        return 1
+    return max(1, math.ceil(len(text) / chunk_size))
+
+
+def _iter_text_chunks(text: str, chunk_size: int = AI_STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Yield balanced chunks for streaming; an empty text still yields one empty chunk."""
 
     if chunk_size <= 0:
-        return [text]
-    return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        yield text
+        return
+    for index in range(_chunk_count(text, chunk_size)):
+        yield text[index * chunk_size : (index + 1) * chunk_size]
+
+
+_REWRITE_MAP: dict[str, str] = {
+    "应当": "应",
+    "不得": "严禁",
+    "立即": "立刻",
+    "双方": "双方各方",
+    "保证": "确保",
+}
+# 各关键词互不重叠，单次扫描与依次 replace 结果一致
+_REWRITE_RE = re.compile("|".join(map(re.escape, _REWRITE_MAP)))
+
+
+def _rewrite_replacement(match: re.Match[str]) -> str:
+    return _REWRITE_MAP[match.group(0)]
 
 
 def _simulate_ai_response(action: AiAction, text: str, instruction: str = "") -> str:
@@ -195,13 +246,7 @@ def _simulate_ai_response(action: AiAction, text: str, instruction: str = "") ->
         )
 
     if action is AiAction.REWRITE:
-        rewritten = (
-            clean_text.replace("应当", "应")
-            .replace("不得", "严禁")
-            .replace("立即", "立刻")
-            .replace("双方", "双方各方")
-            .replace("保证", "确保")
-        )
+        rewritten = _REWRITE_RE.sub(_rewrite_replacement, clean_text)
         if rewritten == clean_text:
             return f"经优化表述：{clean_text}"
         return rewritten
@@ -228,14 +273,17 @@ async def stream_ai_editor(
     text: str = "",
     instruction: str = "",
     request_id: str | None = None,
+    chunk_delay: Annotated[
+        float, Query(ge=0, le=2.0, description="分片之间的间隔秒数，压测时可设为 0")
+    ] = AI_STREAM_CHUNK_DELAY,
 ) -> StreamingResponse:
     """Stream AI results for the editor via SSE."""
 
     clean_text = text.strip()
     resolved_request_id = request_id or uuid.uuid4().hex
 
-    async def event_publisher() -> AsyncGenerator[str, None]:
-        yield "retry: 3000\n\n"
+    async def event_publisher() -> AsyncGenerator[bytes, None]:
+        yield b"retry: 3000\n\n"
         start_payload = {
             "requestId": resolved_request_id,
             "action": action.value,
@@ -243,7 +291,7 @@ async def stream_ai_editor(
             "instruction": instruction,
         }
         yield _format_sse(
-            data=json.dumps(start_payload, ensure_ascii=False),
+            payload=start_payload,
             event="start",
             event_id=f"{resolved_request_id}:0",
         )
@@ -255,40 +303,43 @@ async def stream_ai_editor(
                 "message": "请选择一段文本后再试。",
             }
             yield _format_sse(
-                data=json.dumps(done_payload, ensure_ascii=False),
+                payload=done_payload,
                 event="done",
                 event_id=f"{resolved_request_id}:1",
             )
             return
 
         ai_result = _simulate_ai_response(action, clean_text, instruction)
-        chunks = _chunk_text(ai_result)
+        # 分片按需切出，不预先构建整个列表
+        total_chunks = _chunk_count(ai_result)
 
-        for index, chunk in enumerate(chunks, start=1):
+        # chunk 帧除序号与 data 外完全相同，id 前缀只编码一次，逐帧直接拼接
+        chunk_id_prefix = f"{resolved_request_id}:".encode("utf-8")
+        for index, chunk in enumerate(_iter_text_chunks(ai_result), start=1):
             chunk_payload = {
                 "requestId": resolved_request_id,
                 "content": chunk,
                 "index": index,
-                "total": len(chunks),
+                "total": total_chunks,
             }
-            yield _format_sse(
-                data=json.dumps(chunk_payload, ensure_ascii=False),
-                event="chunk",
-                event_id=f"{resolved_request_id}:{index}",
+            yield b"id: %s%d\nevent: chunk\ndata: %s\n\n" % (
+                chunk_id_prefix,
+                index,
+                orjson.dumps(chunk_payload),
             )
-            await asyncio.sleep(0.18)
+            await asyncio.sleep(chunk_delay)
 
         done_payload = {
             "requestId": resolved_request_id,
             "status": "completed",
             "result": ai_result,
-            "totalChunks": len(chunks),
+            "totalChunks": total_chunks,
             "meta": {"instruction": instruction},
         }
         yield _format_sse(
-            data=json.dumps(done_payload, ensure_ascii=False),
+            payload=done_payload,
             event="done",
-            event_id=f"{resolved_request_id}:{len(chunks) + 1}",
+            event_id=f"{resolved_request_id}:{total_chunks + 1}",
         )
 
     headers = {
@@ -298,118 +349,341 @@ async def stream_ai_editor(
     return StreamingResponse(event_publisher(), media_type="text/event-stream", headers=headers)
 
 
+def _lower_suffix(filename: str) -> str:
+    dot_index = filename.rfind(".")
+    return filename[dot_index:].lower() if dot_index >= 0 else ""
+
+
 def _ensure_docx(file: UploadFile) -> None:
-    if not file.filename.lower().endswith(".docx"):
+    if _lower_suffix(file.filename or "") != ".docx":
         raise HTTPException(status_code=400, detail="Only .docx files are supported")
 
     if file.content_type not in SUPPORTED_MIME_TYPES:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
 
-async def _convert_to_html(file: UploadFile) -> tuple[str, list[ConversionNote]]:
+_CacheValue = TypeVar("_CacheValue")
+
+CONVERSION_CACHE_SIZE = 64
+
+
+class _DigestLRUCache:
+    """按上传内容的 BLAKE2b 摘要缓存转换结果，只保存摘要而不持有原始字节。"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, object] = OrderedDict()
+        # 转换在线程池中执行，字典操作需加锁；计算本身不持锁
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> object | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: object) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self, raw_bytes: bytes, compute: Callable[[bytes], _CacheValue]
+    ) -> _CacheValue:
+        key = hashlib.blake2b(raw_bytes, digest_size=16).digest()
+        cached = self.get(key)
+        if cached is not None:
+            return cached  # type: ignore[return-value]
+
+        value = compute(raw_bytes)
+        self.put(key, value)
+        return value
+
+
+_html_conversion_cache = _DigestLRUCache(CONVERSION_CACHE_SIZE)
+_docx_text_cache = _DigestLRUCache(CONVERSION_CACHE_SIZE)
+# 比对结果以 ETag（两份上传摘要与高亮开关的摘要）为键缓存，重复比对跳过转换与整条流水线
+DIFF_RESULT_CACHE_SIZE = 32
+_diff_result_cache = _DigestLRUCache(DIFF_RESULT_CACHE_SIZE)
+
+
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+
+
+async def _digest_upload(file: UploadFile) -> tuple[bytes, int]:
+    """Hash an upload chunk by chunk; returns the conversion cache key and the byte count."""
+
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_READ_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    await file.seek(0)
+    return digest.digest(), size
+
+
+async def _checked_upload_digest(file: UploadFile) -> bytes:
     _ensure_docx(file)
 
-    raw_bytes = await file.read()
-    if not raw_bytes:
+    # 分块计算摘要，命中缓存时无需把整个上传读成 bytes；未命中时才在线程池中读取并转换
+    cache_key, size = await _digest_upload(file)
+    if not size:
         raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    return cache_key
+
+
+async def _convert_to_html(
+    file: UploadFile, cache_key: bytes | None = None
+) -> tuple[str, list[ConversionNote]]:
+    if cache_key is None:
+        cache_key = await _checked_upload_digest(file)
+
+    cached = _html_conversion_cache.get(cache_key)
+    if cached is None:
+        cached = await asyncio.to_thread(_convert_docx_to_html, file.file)
+        _html_conversion_cache.put(cache_key, cached)
+    html_content, notes = cached
+    return html_content, list(notes)
+
 
+def _convert_docx_to_html(source: BinaryIO) -> tuple[str, tuple[ConversionNote, ...]]:
+    import mammoth
+
+    # 超过内存阈值的上传落盘后 name 为文件描述符，mammoth 会把它当作路径，因此读入内存后再转换
     try:
-        with io.BytesIO(raw_bytes) as buffer:
+        with io.BytesIO(source.read()) as buffer:
             result = mammoth.convert_to_html(buffer, style_map=STYLE_MAP)
     except Exception as exc:  # pragma: no cover - defensive
         raise HTTPException(status_code=500, detail="Failed to process document") from exc
 
     html_content = result.value.strip()
+    notes = tuple(
+        ConversionNote.model_construct(type=message.type, message=message.message)
+        for message in result.messages
+    )
+    return html_content, notes
 
-    notes: list[ConversionNote] = []
-    if result.messages:
-        notes = [
-            ConversionNote(type=message.type, message=message.message)
-            for message in result.messages
-        ]
 
-    return html_content, notes
+CJK_CODEPOINT_RANGES: tuple[tuple[int, int], ...] = (
+    (0x4E00, 0x9FFF),  # CJK Unified Ideographs
+    (0x3400, 0x4DBF),  # CJK Unified Ideographs Extension A
+    (0x20000, 0x2A6DF),  # CJK Unified Ideographs Extension B
+    (0x2A700, 0x2B73F),  # CJK Unified Ideographs Extension C
+    (0x2B740, 0x2B81F),  # CJK Unified Ideographs Extension D
+    (0x2B820, 0x2CEAF),  # CJK Unified Ideographs Extension E
+    (0xF900, 0xFAFF),  # CJK Compatibility Ideographs
+)
+
+
+def _build_cjk_bmp_mask() -> bytes:
+    mask = bytearray(0x10000)
+    for start, end in CJK_CODEPOINT_RANGES:
+        if end < 0x10000:
+            mask[start : end + 1] = b"\x01" * (end - start + 1)
+    return bytes(mask)
+
+
+def _build_cjk_astral_bounds() -> tuple[int, ...]:
+    """Flatten the astral ranges into sorted half-open bounds, merging adjacent ranges."""
+
+    bounds: list[int] = []
+    for start, end in sorted(CJK_CODEPOINT_RANGES):
+        if start < 0x10000:
+            continue
+        if bounds and bounds[-1] == start:
+            bounds[-1] = end + 1
+        else:
+            bounds.extend((start, end + 1))
+    return tuple(bounds)
+
+
+# 基本多文种平面内的 CJK 判定查表完成；扩展平面的区间展平为有序边界，二分后按奇偶判断是否落在区间内
+_CJK_BMP_MASK = _build_cjk_bmp_mask()
+_CJK_ASTRAL_BOUNDS = _build_cjk_astral_bounds()
 
 
 def _is_cjk_char(char: str) -> bool:
     if not char:
         return False
     codepoint = ord(char)
-    return (
-        0x4E00 <= codepoint <= 0x9FFF  # CJK Unified Ideographs
-        or 0x3400 <= codepoint <= 0x4DBF  # CJK Unified Ideographs Extension A
-        or 0x20000 <= codepoint <= 0x2A6DF  # CJK Unified Ideographs Extension B
-        or 0x2A700 <= codepoint <= 0x2B73F  # CJK Unified Ideographs Extension C
-        or 0x2B740 <= codepoint <= 0x2B81F  # CJK Unified Ideographs Extension D
-        or 0x2B820 <= codepoint <= 0x2CEAF  # CJK Unified Ideographs Extension E
-        or 0xF900 <= codepoint <= 0xFAFF  # CJK Compatibility Ideographs
+    if codepoint < 0x10000:
+        return bool(_CJK_BMP_MASK[codepoint])
+    return bisect_right(_CJK_ASTRAL_BOUNDS, codepoint) & 1 == 1
+
+
+def _build_token_pattern() -> re.Pattern[str]:
+    """空白、CJK 字符与标点各自成为单字符 token，其余连续字符合并为一个词。"""
+
+    # 标点（Unicode P 类）与空白只分布在前两个平面，扫描 0x20000 以内即可
+    separators = [
+        (codepoint, codepoint)
+        for codepoint in range(0x20000)
+        if unicodedata.category(chr(codepoint))[0] == "P" or chr(codepoint).isspace()
+    ]
+    merged: list[list[int]] = []
+    for start, end in sorted(separators + list(CJK_CODEPOINT_RANGES)):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    char_class = "".join(
+        re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+        for start, end in merged
     )
+    return re.compile(f"[{char_class}]|[^{char_class}]+")
 
 
-def _is_punctuation(char: str) -> bool:
-    return unicodedata.category(char).startswith("P")
+_TOKEN_RE = _build_token_pattern()
 
 
 def _tokenize_text(text: str) -> list[str]:
-    tokens: list[str] = []
-    buffer: list[str] = []
+    return _TOKEN_RE.findall(text)
 
-    def flush_buffer() -> None:
-        if buffer:
-            tokens.append("".join(buffer))
-            buffer.clear()
 
-    for char in text:
-        if char.isspace():
-            flush_buffer()
-            tokens.append(char)
-            continue
-
-        if _is_cjk_char(char) or _is_punctuation(char):
-            flush_buffer()
-            tokens.append(char)
-            continue
+_HTML_SPECIAL_RE = re.compile(r"[&<>\"']")
+# 与 html.escape(quote=True) 等价的单次转换表
+_HTML_ESCAPE_TABLE = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"}
+)
 
-        buffer.append(char)
 
-    flush_buffer()
+def _escape_token_list(tokens: list[str]) -> list[str]:
+    # 绝大多数 token 不含特殊字符，直接复用原字符串
+    needs_escape = _HTML_SPECIAL_RE.search
+    table = _HTML_ESCAPE_TABLE
+    return [token.translate(table) if needs_escape(token) else token for token in tokens]
 
-    return tokens
 
+def _prepare_html_tokens(
+    html_content: str,
+) -> tuple[etree._Element, list[str], list[dict[str, object]], list[str]]:
+    """Tokenize text nodes; escaped_tokens holds the HTML-escaped form of each token."""
 
-def _prepare_html_tokens(html_content: str) -> tuple[BeautifulSoup, list[str], list[dict[str, object]]]:
-    soup = BeautifulSoup(html_content or "", "html.parser")
+    root = _parse_html_fragment(html_content)
     tokens: list[str] = []
+    escaped_tokens: list[str] = []
     node_infos: list[dict[str, object]] = []
+    tokenize = _tokenize_text
+    intern = sys.intern
+    needs_escape = _HTML_SPECIAL_RE.search
+    escape_tokens = _escape_token_list
+    extend_tokens = tokens.extend
+    extend_escaped = escaped_tokens.extend
+    append_info = node_infos.append
+
+    # 单次文档序遍历：记录每个元素之前最近的标题，供差异定位直接使用
+    current_heading: etree._Element | None = None
+    heading_before: dict[etree._Element, etree._Element | None] = {}
+    block_by_parent: dict[etree._Element, etree._Element | None] = {}
+    preserve_depth = 0
+
+    def collect(element: etree._Element, slot: str, parent: etree._Element | None) -> None:
+        text = element.text if slot == "text" else element.tail
+        if not text:
+            return
 
-    for node in soup.descendants:
-        if not isinstance(node, NavigableString):
-            continue
-
-        text = str(node)
-        if text == "":
-            continue
+        # 沿用 html.parser 的处理：pre/textarea 之外的纯空白文本折叠为单个空格或换行
+        if not preserve_depth and _ASCII_WHITESPACE_RE.fullmatch(text):
+            text = "\n" if "\n" in text else " "
+            if slot == "text":
+                element.text = text
+            else:
+                element.tail = text
 
-        parts = _tokenize_text(text)
+        if parent is None:
+            return
+        # 驻留 token：重复的短词共享同一对象，比对时哈希与相等判断只需比较指针
+        parts = list(map(intern, tokenize(text)))
         if not parts:
-            continue
+            return
+
+        if parent in block_by_parent:
+            block = block_by_parent[parent]
+        else:
+            block = block_by_parent[parent] = _find_block_node(parent, root)
+        anchor = block if block is not None else parent
+        if anchor.tag in HEADING_TAG_NAMES:
+            heading = anchor
+        else:
+            heading = heading_before.get(anchor)
 
         start_index = len(tokens)
-        tokens.extend(parts)
-        node_infos.append(
+        extend_tokens(parts)
+        # 整段文本不含特殊字符时（含纯空白片段）无需逐 token 检查
+        extend_escaped(escape_tokens(parts) if needs_escape(text) else parts)
+        append_info(
             {
-                "node": node,
+                "element": element,
+                "slot": slot,
+                "parent": parent,
                 "tokens": parts,
                 "start": start_index,
                 "end": len(tokens),
+                "block": block,
+                "heading": heading,
             }
         )
 
-    return soup, tokens, node_infos
+    for event, element in etree.iterwalk(root, events=("start", "end", "comment", "pi")):
+        if event == "start":
+            heading_before[element] = current_heading
+            if element.tag in HEADING_TAG_NAMES:
+                current_heading = element
+            elif element.tag in WHITESPACE_PRESERVING_TAGS:
+                preserve_depth += 1
+            # 多数元素的 text/tail 为空，先在循环内判断，避免无谓的函数调用
+            if element.text:
+                collect(element, "text", element)
+            continue
+
+        if event == "end" and element.tag in WHITESPACE_PRESERVING_TAGS:
+            preserve_depth -= 1
+        if element.tail and element is not root:
+            # 注释/处理指令没有子节点，其 tail 紧随其后
+            collect(element, "tail", element.getparent())
+
+    return root, tokens, node_infos, escaped_tokens
+
+
+_ASCII_WHITESPACE_RE = re.compile(r"[ \n\t\f\r]+")
+WHITESPACE_PRESERVING_TAGS = frozenset({"pre", "textarea"})
+
+
+def _parse_html_fragment(html_content: str) -> etree._Element:
+    """Parse HTML into a wrapper <div> so top-level text and siblings share one root."""
+
+    if not html_content:
+        return etree.Element("div")
+    # fragment_fromstring 会丢弃仅含空白的前导文本，这里直接取 <body> 作为根节点
+    document = document_fromstring(f"<html><body>{html_content}</body></html>")
+    root = document.find("body")
+    root.tag = "div"
+    return root
+
+
+def _serialize_html_fragment(root: etree._Element) -> str:
+    serialized = etree.tostring(root, encoding="unicode", method="html")
+    return serialized[len("<div>") : -len("</div>")]
+
+
+def _element_text(element: etree._Element) -> str:
+    """Equivalent of BeautifulSoup's ``get_text(" ", strip=True)``."""
+
+    return " ".join(part.strip() for part in element.itertext() if part.strip())
 
 
-def _escape_tokens(tokens: list[str]) -> str:
-    return "".join(html.escape(token) for token in tokens)
+def _cached_element_text(element: etree._Element, cache: dict[etree._Element, str]) -> str:
+    """``_element_text`` memoized per element; a section heading is shared by many diff locations."""
+
+    text = cache.get(element)
+    if text is None:
+        text = cache[element] = _element_text(element)
+    return text
 
 
 def _truncate_text(value: str, limit: int = 80) -> str:
@@ -441,30 +715,123 @@ def _mask_text_with_map(text: str, mask_map: dict[str, str]) -> str:
     if not text or not mask_map:
         return text
 
+    # 掩码值只含空白与占位符号，不含反斜杠转义，str.replace 与按转义后正则替换结果一致
     sanitized = text
-    for raw, masked in sorted(mask_map.items(), key=lambda item: len(item[0]), reverse=True):
-        sanitized = re.sub(re.escape(raw), masked, sanitized)
+    for raw in sorted(mask_map, key=len, reverse=True):
+        if raw in sanitized:
+            sanitized = sanitized.replace(raw, mask_map[raw])
     return sanitized
 
 
+_DOCX_XML_PARSER = etree.XMLParser(resolve_entities=False)
+_DOCX_DEFAULT_MAIN_PART = "word/document.xml"
+# 与 docx.oxml.ns.qn("w:...") 等价的 Clark 记法标签名
+_W_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY = f"{_W_NAMESPACE}body"
+_W_P = f"{_W_NAMESPACE}p"
+_W_R = f"{_W_NAMESPACE}r"
+_W_T = f"{_W_NAMESPACE}t"
+_W_BR = f"{_W_NAMESPACE}br"
+_W_TYPE = f"{_W_NAMESPACE}type"
+_W_HYPERLINK = f"{_W_NAMESPACE}hyperlink"
+_W_TBL = f"{_W_NAMESPACE}tbl"
+_W_TR = f"{_W_NAMESPACE}tr"
+_W_TC = f"{_W_NAMESPACE}tc"
+# 与 python-docx Run.text 保持一致的内联元素文本映射
+_W_RUN_CHARS: dict[str, str] = {
+    f"{_W_NAMESPACE}tab": "\t",
+    f"{_W_NAMESPACE}ptab": "\t",
+    f"{_W_NAMESPACE}cr": "\n",
+    f"{_W_NAMESPACE}noBreakHyphen": "-",
+}
+
+
+def _docx_main_part_name(archive: zipfile.ZipFile) -> str:
+    try:
+        rels = etree.fromstring(archive.read("_rels/.rels"), _DOCX_XML_PARSER)
+    except KeyError:
+        return _DOCX_DEFAULT_MAIN_PART
+
+    for rel in rels:
+        if str(rel.get("Type", "")).endswith("/officeDocument"):
+            return str(rel.get("Target", _DOCX_DEFAULT_MAIN_PART)).lstrip("/")
+    return _DOCX_DEFAULT_MAIN_PART
+
+
+def _docx_run_text(run: etree._Element) -> str:
+    parts: list[str] = []
+    for child in run:
+        tag = child.tag
+        if tag == _W_T:
+            parts.append(child.text or "")
+        elif tag == _W_BR:
+            if child.get(_W_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        else:
+            char = _W_RUN_CHARS.get(tag)
+            if char:
+                parts.append(char)
+    return "".join(parts)
+
+
+def _docx_paragraph_text(paragraph: etree._Element) -> str:
+    parts: list[str] = []
+    for child in paragraph:
+        if child.tag == _W_R:
+            parts.append(_docx_run_text(child))
+        elif child.tag == _W_HYPERLINK:
+            parts.extend(_docx_run_text(run) for run in child.iterchildren(_W_R))
+    return "".join(parts)
+
+
 def _collect_docx_text(raw_bytes: bytes) -> str:
+    return _docx_text_cache.get_or_compute(raw_bytes, _extract_docx_text)
+
+
+def _extract_docx_text(raw_bytes: bytes) -> str:
+    texts: list[str] = []
+    table_texts: list[str] = []
+    # 流式解析正文：每个 body 级段落或表格解析完毕即提取文本并释放，内存只保留当前块
     try:
-        document = Document(io.BytesIO(raw_bytes))
+        with zipfile.ZipFile(io.BytesIO(raw_bytes)) as archive:
+            with archive.open(_docx_main_part_name(archive)) as stream:
+                for _, element in etree.iterparse(
+                    stream,
+                    events=("end",),
+                    tag=(_W_P, _W_TBL),
+                    resolve_entities=False,
+                ):
+                    body = element.getparent()
+                    if body is None or body.tag != _W_BODY or body.getparent().getparent() is not None:
+                        continue
+                    if element.tag == _W_P:
+                        text = _docx_paragraph_text(element)
+                        if text:
+                            texts.append(text)
+                    else:
+                        table_texts.extend(_docx_table_cell_texts(element))
+                    element.clear(keep_tail=True)
+                    while element.getprevious() is not None:
+                        del body[0]
     except Exception as exc:  # pragma: no cover - defensive
         raise HTTPException(status_code=400, detail="无法读取合同内容，请确认文件是否为有效的 Word 文档") from exc
 
-    texts: list[str] = []
-    for paragraph in document.paragraphs:
-        if paragraph.text:
-            texts.append(paragraph.text)
+    # 与原先一致：先输出正文段落，再输出各表格单元格
+    texts.extend(table_texts)
+    return "\n".join(texts)
 
-    for table in document.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if cell.text:
-                    texts.append(cell.text)
 
-    return "\n".join(texts)
+def _docx_table_cell_texts(table: etree._Element) -> Iterator[str]:
+    for row in table.iterchildren(_W_TR):
+        for cell in row.iterchildren(_W_TC):
+            text = "\n".join(
+                _docx_paragraph_text(paragraph) for paragraph in cell.iterchildren(_W_P)
+            )
+            if text:
+                yield text
+
+
+_HIT_SORT_KEY = attrgetter("category", "field", "value")
 
 
 def _find_sensitive_hits(text: str) -> list[SensitiveHit]:
@@ -485,7 +852,8 @@ def _find_sensitive_hits(text: str) -> list[SensitiveHit]:
 
                 key = (str(config["field"]), cleaned_value)
                 if key not in hit_map:
-                    hit_map[key] = SensitiveHit(
+                    # 字段值均由本函数生成、类型确定，跳过 pydantic 校验，响应时仍按 response_model 校验
+                    hit_map[key] = SensitiveHit.model_construct(
                         category=str(config["category"]),
                         field=str(config["field"]),
                         value=cleaned_value,
@@ -494,12 +862,13 @@ def _find_sensitive_hits(text: str) -> list[SensitiveHit]:
                 else:
                     hit_map[key].count += 1
 
-    return sorted(hit_map.values(), key=lambda hit: (hit.category, hit.field, hit.value))
+    return sorted(hit_map.values(), key=_HIT_SORT_KEY)
 
 
-def _sanitize_docx_bytes(docx_bytes: bytes, mask_map: dict[str, str]) -> bytes:
+def _sanitize_docx_bytes(docx_bytes: bytes, mask_map: dict[str, str]) -> io.BytesIO:
     if not mask_map:
-        return docx_bytes
+        # BytesIO 初始化时与原 bytes 共享内存，不会复制
+        return io.BytesIO(docx_bytes)
 
     input_buffer = io.BytesIO(docx_bytes)
     output_buffer = io.BytesIO()
@@ -515,14 +884,14 @@ def _sanitize_docx_bytes(docx_bytes: bytes, mask_map: dict[str, str]) -> bytes:
                 data = masked_text.encode("utf-8")
             target_zip.writestr(item, data)
 
-    return output_buffer.getvalue()
+    return output_buffer
 
 
 async def _read_word_file_bytes(file: UploadFile) -> tuple[bytes, str]:
     filename = (file.filename or "合同.docx").strip()
-    lowered = filename.lower()
+    suffix = _lower_suffix(filename)
 
-    if not lowered.endswith((".docx", ".doc")):
+    if suffix not in WORD_FILE_SUFFIXES:
         raise HTTPException(status_code=400, detail="仅支持上传 .doc 或 .docx 合同文件")
 
     if file.content_type not in WORD_FILE_MIME_TYPES:
@@ -532,13 +901,38 @@ async def _read_word_file_bytes(file: UploadFile) -> tuple[bytes, str]:
     if not raw_bytes:
         raise HTTPException(status_code=400, detail="上传文件为空")
 
-    if lowered.endswith(".doc"):
+    if suffix == ".doc":
         raise HTTPException(status_code=400, detail="暂不支持 .doc，请先转为 .docx 后再试")
 
     return raw_bytes, filename
 
 
-PatternGroup = tuple[re.Pattern[str], int]
+class _RunStartPattern:
+    """``finditer`` 结果与 ``re.compile(pattern)`` 一致，但不在连续字符段中间逐位重试。
+
+    ``pattern`` 以 ``run_chars`` 字符集的不定长前缀开头：若某位置能匹配，则其前一个同字符集
+    位置也能匹配，因此最左匹配只可能出现在上一个匹配的结尾或字符段起点。前者直接 ``match``，
+    后者用否定后顾锚定后 ``search``，长串文本在后缀匹配失败时不会反复回溯。
+    """
+
+    def __init__(self, run_chars: str, pattern: str) -> None:
+        self._pattern = re.compile(pattern)
+        self._run_start = re.compile(f"(?<!{run_chars}){pattern}")
+
+    def finditer(self, text: str) -> Iterator[re.Match[str]]:
+        pos = 0
+        while True:
+            match = self._pattern.match(text, pos) or self._run_start.search(text, pos)
+            if match is None:
+                return
+            yield match
+            pos = match.end()
+
+
+PatternGroup = tuple[re.Pattern[str] | _RunStartPattern, int]
+
+# 前缀字符集不设长度上限（上限会截断超长名称/地址，只脱敏末尾一段）；
+# 占有量词 (*+ / {m,}+) 仅用于后续字符与字符集不重叠的位置（需 Python 3.11+）。
 
 
 SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
@@ -547,8 +941,9 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
         "field": "企业名称",
         "patterns": [
             (
-                re.compile(
-                    r"[\u4e00-\u9fa5A-Za-z0-9（）()·]{2,}(?:有限责任公司|股份有限公司|有限公司|集团|公司|合伙企业|工作室|事务所)"
+                _RunStartPattern(
+                    r"[\u4e00-\u9fa5A-Za-z0-9（）()·]",
+                    r"[\u4e00-\u9fa5A-Za-z0-9（）()·]{2,}(?:有限责任公司|股份有限公司|有限公司|集团|公司|合伙企业|工作室|事务所)",
                 ),
                 0,
             ),
@@ -588,15 +983,23 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
     {
         "category": "联系方式",
         "field": "邮箱",
-        "patterns": [(re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"), 0)],
+        "patterns": [
+            (
+                _RunStartPattern(
+                    r"[A-Za-z0-9._%+-]", r"[A-Za-z0-9._%+-]++@[A-Za-z0-9.-]+\.[A-Za-z]{2,}+"
+                ),
+                0,
+            )
+        ],
     },
     {
         "category": "地址",
         "field": "地址",
         "patterns": [
             (
-                re.compile(
-                    r"[\u4e00-\u9fa5A-Za-z0-9]{2,}(?:省|市|自治区|区|县|镇|乡|街道|大道|路|街|巷|号)[\u4e00-\u9fa5A-Za-z0-9#\-（）()]{2,40}"
+                _RunStartPattern(
+                    r"[\u4e00-\u9fa5A-Za-z0-9]",
+                    r"[\u4e00-\u9fa5A-Za-z0-9]{2,}(?:省|市|自治区|区|县|镇|乡|街道|大道|路|街|巷|号)[\u4e00-\u9fa5A-Za-z0-9#\-（）()]{2,40}",
                 ),
                 0,
             )
@@ -610,7 +1013,7 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
     {
         "category": "企业注册信息",
         "field": "法定代表人",
-        "patterns": [(re.compile(r"法定代表人[:：]?\s*([\u4e00-\u9fa5]{2,4})"), 1)],
+        "patterns": [(re.compile(r"法定代表人[:：]?\s*+([\u4e00-\u9fa5]{2,4})"), 1)],
     },
     {
         "category": "银行与税务信息",
@@ -622,7 +1025,9 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
         "field": "开户银行",
         "patterns": [
             (
-                re.compile(r"[\u4e00-\u9fa5A-Za-z]{2,}(?:银行|信用社|合作社)[\u4e00-\u9fa5A-Za-z]*"),
+                _RunStartPattern(
+                    r"[\u4e00-\u9fa5A-Za-z]", r"[\u4e00-\u9fa5A-Za-z]{2,}(?:银行|信用社|合作社)[\u4e00-\u9fa5A-Za-z]*+"
+                ),
                 0,
             )
         ],
@@ -635,14 +1040,14 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
     {
         "category": "合同与项目标识",
         "field": "合同编号",
-        "patterns": [(re.compile(r"合同编号[:：]?\s*([A-Za-z0-9\-]{4,})"), 1)],
+        "patterns": [(re.compile(r"合同编号[:：]?\s*+([A-Za-z0-9\-]{4,}+)"), 1)],
     },
     {
         "category": "合同与项目标识",
         "field": "项目名称",
         "patterns": [
             (
-                re.compile(r"项目名称[:：]?\s*([\u4e00-\u9fa5A-Za-z0-9（）()·\-]{2,})"),
+                re.compile(r"项目名称[:：]?\s*+([\u4e00-\u9fa5A-Za-z0-9（）()·\-]{2,}+)"),
                 1,
             )
         ],
@@ -666,7 +1071,7 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
         "field": "时间段",
         "patterns": [
             (
-                re.compile(r"\b\d{4}年\d{1,2}月\d{1,2}日\s*[至\-]+\s*\d{4}年\d{1,2}月\d{1,2}日\b"),
+                re.compile(r"\b\d{4}年\d{1,2}月\d{1,2}日\s*+[至\-]++\s*+\d{4}年\d{1,2}月\d{1,2}日\b"),
                 0,
             )
         ],
@@ -674,6 +1079,29 @@ SENSITIVE_FIELD_CONFIGS: list[dict[str, object]] = [
 ]
 
 
+HEADING_TAG_NAMES = frozenset({"h1", "h2", "h3", "h4", "h5", "h6"})
+
+BLOCK_TAG_NAMES = frozenset(
+    {
+        "p",
+        "li",
+        "td",
+        "th",
+        "caption",
+        "blockquote",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "pre",
+        "code",
+        "div",
+    }
+)
+
+
 EXPORT_BLOCK_TAGS: tuple[str, ...] = (
     "h1",
     "h2",
@@ -690,29 +1118,85 @@ EXPORT_BLOCK_TAGS: tuple[str, ...] = (
 )
 
 
+_FILENAME_BAD_RE = re.compile(r"[\\/:*?\"<>|]")
+_WHITESPACE_RUN_RE = re.compile(r"\s+")
+_STORAGE_NAME_BAD_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
 def _sanitize_filename(value: str | None) -> str:
     if not value:
         return "合同导入编辑"
-    sanitized = re.sub(r"[\\/:*?\"<>|]", "_", value)
-    sanitized = re.sub(r"\s+", " ", sanitized).strip()
+    sanitized = _FILENAME_BAD_RE.sub("_", value)
+    sanitized = _WHITESPACE_RUN_RE.sub(" ", sanitized).strip()
     return sanitized or "合同导入编辑"
 
 
-def _html_to_plaintext_lines(html_content: str) -> list[str]:
-    soup = BeautifulSoup(html_content or "", "html.parser")
-    body = soup.body or soup
-    lines: list[str] = []
+@dataclass(frozen=True, slots=True)
+class ExportBlock:
+    name: str
+    text: str
+    ordered: bool = False
+    rows: tuple[tuple[str, ...], ...] = ()
+
+
+# 导出路径使用 lxml 解析器，只构建块级标签（及列表容器）子树
+_EXPORT_HTML_PARSER = "lxml"
+_EXPORT_BLOCK_STRAINER = SoupStrainer(EXPORT_BLOCK_TAGS + ("ol", "ul"))
+
+
+# 以 HTML 的 BLAKE2b 摘要为键，缓存只持有解析出的块而不持有整段 HTML
+_export_blocks_cache = _DigestLRUCache(8)
+
+
+def _extract_export_blocks(html_content: str) -> tuple[ExportBlock, ...]:
+    """Parse export HTML once; the same content exported in several formats reuses the result."""
+
+    key = hashlib.blake2b(html_content.encode("utf-8"), digest_size=16).digest()
+    cached = _export_blocks_cache.get(key)
+    if cached is None:
+        cached = _parse_export_blocks(html_content)
+        _export_blocks_cache.put(key, cached)
+    return cached  # type: ignore[return-value]
 
-    for block in body.find_all(EXPORT_BLOCK_TAGS):
+
+def _parse_export_blocks(html_content: str) -> tuple[ExportBlock, ...]:
+    soup = BeautifulSoup(html_content, _EXPORT_HTML_PARSER, parse_only=_EXPORT_BLOCK_STRAINER)
+    blocks: list[ExportBlock] = []
+
+    for block in soup.find_all(EXPORT_BLOCK_TAGS):
         separator = "\n" if block.name in {"pre", "code"} else " "
         text = block.get_text(separator, strip=True)
-        if text == "":
+
+        if block.name == "li":
+            parent = block.parent if isinstance(block.parent, Tag) else None
+            ordered = bool(parent and parent.name == "ol")
+            blocks.append(ExportBlock(block.name, text, ordered=ordered))
+        elif block.name == "table":
+            rows = tuple(
+                tuple(cell.get_text(" ", strip=True) for cell in row.find_all(["th", "td"]))
+                for row in block.find_all("tr")
+            )
+            blocks.append(ExportBlock(block.name, text, rows=rows))
+        else:
+            blocks.append(ExportBlock(block.name, text))
+
+    return tuple(blocks)
+
+
+def _html_to_plaintext_lines(html_content: str) -> list[str]:
+    lines: list[str] = []
+
+    for block in _extract_export_blocks(html_content or ""):
+        if block.text == "":
             lines.append("")
             continue
-        parts = text.splitlines() or [""]
+        parts = block.text.splitlines() or [""]
         lines.extend(parts)
 
     if not lines:
+        # 没有块级标签时才需要完整文档树
+        full_soup = BeautifulSoup(html_content or "", _EXPORT_HTML_PARSER)
+        body = full_soup.body or full_soup
         fallback = (body.get_text("\n", strip=True) or "").splitlines()
         if fallback:
             lines.extend(fallback)
@@ -723,17 +1207,17 @@ def _html_to_plaintext_lines(html_content: str) -> list[str]:
 
 
 def _render_docx_document(html_content: str) -> io.BytesIO:
+    from docx import Document
+    from docx.shared import Pt
+
     document = Document()
-    soup = BeautifulSoup(html_content or "", "html.parser")
-    body = soup.body or soup
-    blocks = body.find_all(EXPORT_BLOCK_TAGS)
+    blocks = _extract_export_blocks(html_content or "")
 
     if not blocks:
         document.add_paragraph("")
 
     for block in blocks:
-        separator = "\n" if block.name in {"pre", "code"} else " "
-        text = block.get_text(separator, strip=True)
+        text = block.text
 
         if block.name.startswith("h") and len(block.name) == 2 and block.name[1].isdigit():
             level = max(0, min(int(block.name[1]) - 1, 4))
@@ -741,8 +1225,7 @@ def _render_docx_document(html_content: str) -> io.BytesIO:
             continue
 
         if block.name == "li":
-            parent = block.parent if isinstance(block.parent, Tag) else None
-            style = "List Number" if parent and parent.name == "ol" else "List Bullet"
+            style = "List Number" if block.ordered else "List Bullet"
             document.add_paragraph(text or "", style=style)
             continue
 
@@ -766,19 +1249,18 @@ def _render_docx_document(html_content: str) -> io.BytesIO:
             continue
 
         if block.name == "table":
-            rows = block.find_all("tr")
+            rows = block.rows
             if not rows:
                 continue
-            max_cols = max((len(row.find_all(["th", "td"])) for row in rows), default=0)
+            max_cols = max((len(cells) for cells in rows), default=0)
             if max_cols == 0:
                 continue
             table = document.add_table(rows=len(rows), cols=max_cols)
-            for row_index, row in enumerate(rows):
-                cells = row.find_all(["th", "td"])
-                for col_index, cell in enumerate(cells):
+            for row_index, cells in enumerate(rows):
+                for col_index, cell_text in enumerate(cells):
                     if col_index >= max_cols:
                         break
-                    table.cell(row_index, col_index).text = cell.get_text(" ", strip=True)
+                    table.cell(row_index, col_index).text = cell_text
             document.add_paragraph("")
             continue
 
@@ -791,22 +1273,27 @@ def _render_docx_document(html_content: str) -> io.BytesIO:
 
 
 def _render_pdf_document(html_content: str) -> io.BytesIO:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
     buffer = io.BytesIO()
     pdf = canvas.Canvas(buffer, pagesize=A4)
     _, height = A4
     margin = 25 * mm
-    text_object = pdf.beginText(margin, height - margin)
-    text_object.setFont("Helvetica", 12)
+    font_size = 12
+    leading = font_size * 1.2
+    lines = _html_to_plaintext_lines(html_content)
+    lines_per_page = max(1, math.ceil((height - 2 * margin) / leading))
 
-    for line in _html_to_plaintext_lines(html_content):
-        if text_object.getY() <= margin:
-            pdf.drawText(text_object)
+    for page_start in range(0, len(lines), lines_per_page):
+        if page_start:
             pdf.showPage()
-            text_object = pdf.beginText(margin, height - margin)
-            text_object.setFont("Helvetica", 12)
-        text_object.textLine(line)
+        text_object = pdf.beginText(margin, height - margin)
+        text_object.setFont("Helvetica", font_size, leading)
+        text_object.textLines(lines[page_start : page_start + lines_per_page])
+        pdf.drawText(text_object)
 
-    pdf.drawText(text_object)
     pdf.save()
     buffer.seek(0)
     return buffer
@@ -818,7 +1305,8 @@ def _render_json_document(html_content: str) -> io.BytesIO:
     payload = {
         "html": html_content or "",
         "plain_text": plain_text,
-        "character_count": len(plain_text.replace("\n", "")),
+        # 各行由 splitlines 得到，不含换行符，直接累加长度即可
+        "character_count": sum(map(len, lines)),
         "line_count": len(lines),
     }
     buffer = io.BytesIO(json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8"))
@@ -826,14 +1314,40 @@ def _render_json_document(html_content: str) -> io.BytesIO:
     return buffer
 
 
-def _build_file_response(data: bytes, media_type: str, filename: str) -> StreamingResponse:
-    response = StreamingResponse(iter([data]), media_type=media_type)
-    response.headers["Content-Length"] = str(len(data))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+_ASCII_ALNUM_RE = re.compile(r"[A-Za-z0-9]")
+
+
+def _content_disposition(filename: str) -> str:
     utf8_filename = quote(filename)
-    response.headers[
-        "Content-Disposition"
-    ] = f"attachment; filename=\"{filename}\"; filename*=UTF-8''{utf8_filename}"
-    return response
+    # 响应头仅支持 latin-1，非 ASCII 文件名通过 filename* 传递
+    ascii_filename = filename.encode("ascii", "ignore").decode("ascii")
+    # 名称部分没有任何字母数字（如全中文名只剩 ".docx"）时回退为 download.<后缀>
+    if not _ASCII_ALNUM_RE.search(ascii_filename.rsplit(".", 1)[0]):
+        ascii_filename = f"download{Path(filename).suffix}"
+    return f"attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{utf8_filename}"
+
+
+async def _iter_buffer_chunks(buffer: io.BytesIO) -> AsyncGenerator[bytes, None]:
+    # 异步生成器直接在事件循环中切片内存缓冲区；同步生成器会被 Starlette 逐块放进线程池
+    view = buffer.getbuffer()
+    try:
+        for offset in range(0, view.nbytes, EXPORT_CHUNK_SIZE):
+            yield bytes(view[offset : offset + EXPORT_CHUNK_SIZE])
+    finally:
+        view.release()
+
+
+def _build_stream_response(buffer: io.BytesIO, media_type: str, filename: str) -> StreamingResponse:
+    """Stream an in-memory export without copying it into a second bytes object."""
+
+    headers = {
+        "Content-Disposition": _content_disposition(filename),
+        "Content-Length": str(buffer.getbuffer().nbytes),
+    }
+    return StreamingResponse(_iter_buffer_chunks(buffer), media_type=media_type, headers=headers)
 
 
 def _ensure_onlyoffice_file(file_id: str) -> Path:
@@ -858,18 +1372,25 @@ async def _persist_onlyoffice_upload(file: UploadFile) -> tuple[str, str]:
     if extension not in SUPPORTED_ONLYOFFICE_EXTENSIONS:
         raise HTTPException(status_code=400, detail="暂不支持该文件类型，请上传 Office 文档。")
 
-    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", Path(filename).name) or f"document.{extension}"
+    safe_name = _STORAGE_NAME_BAD_RE.sub("_", Path(filename).name) or f"document.{extension}"
     file_id = f"{uuid.uuid4().hex}_{safe_name}"
 
-    contents = await file.read()
-    if not contents:
-        raise HTTPException(status_code=400, detail="文件内容为空，请重新上传。")
-
+    # 上传内容已缓存在 SpooledTemporaryFile 中，分块复制到目标文件，不在内存中整体读出
     target_path = ONLYOFFICE_STORAGE_DIR / file_id
-    target_path.write_bytes(contents)
+    await file.seek(0)
+    copied = await asyncio.to_thread(_copy_upload_to_path, file.file, target_path)
+    if not copied:
+        target_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="文件内容为空，请重新上传。")
     return file_id, safe_name
 
 
+def _copy_upload_to_path(source: BinaryIO, target_path: Path) -> int:
+    with target_path.open("wb") as target:
+        shutil.copyfileobj(source, target)
+        return target.tell()
+
+
 def _build_onlyoffice_config(file_id: str, display_name: str, request: Request) -> dict[str, object]:
     file_path = _ensure_onlyoffice_file(file_id)
     file_type = Path(display_name).suffix.lstrip(".") or "docx"
@@ -935,23 +1456,40 @@ def _download_onlyoffice_update(download_url: str, target_path: Path) -> None:
     target_path.write_bytes(data)
 
 
-def _markdown_to_blocks(markdown: str) -> list[dict[str, object]]:
-    blocks: list[dict[str, object]] = []
+@dataclass(slots=True)
+class MarkdownBlock:
+    kind: Literal["heading", "paragraph", "ordered_list", "bullet_list"]
+    text: str = ""
+    level: int = 1
+    items: list[str] = field(default_factory=list)
+
+
+# 标题、编号标题、有序列表、无序列表按原有优先级合并为一次匹配
+_MARKDOWN_LINE_RE = re.compile(
+    r"^(?P<hash>#+)\s+(?P<h_text>.*)"
+    r"|^(?P<num>\d+(?:\.\d+)*)\.\s+(?P<n_text>.*)"
+    r"|^\s*\d+[.)]\s+(?P<ol_text>.*)"
+    r"|^\s*[-*+]\s+(?P<ul_text>.*)"
+)
+
+
+def _markdown_to_blocks(markdown: str) -> list[MarkdownBlock]:
+    blocks: list[MarkdownBlock] = []
     lines = (markdown or "").splitlines()
 
     current_paragraph: list[str] = []
-    current_list: dict[str, object] | None = None
+    current_list: MarkdownBlock | None = None
 
     def flush_paragraph() -> None:
         nonlocal current_paragraph
         text = " ".join(part.strip() for part in current_paragraph if part.strip()).strip()
         if text:
-            blocks.append({"type": "paragraph", "text": text})
+            blocks.append(MarkdownBlock(kind="paragraph", text=text))
         current_paragraph = []
 
     def flush_list() -> None:
         nonlocal current_list
-        if current_list and current_list.get("items"):
+        if current_list and current_list.items:
             blocks.append(current_list)
         current_list = None
 
@@ -962,82 +1500,79 @@ def _markdown_to_blocks(markdown: str) -> list[dict[str, object]]:
             flush_list()
             continue
 
-        heading_match = re.match(r"^(#+)\s+(.*)", line)
-        if heading_match:
-            flush_paragraph()
-            flush_list()
-            level = len(heading_match.group(1))
-            text = heading_match.group(2).strip()
-            blocks.append({"type": "heading", "level": min(level, 5), "text": text})
+        match = _MARKDOWN_LINE_RE.match(line)
+        if match is None:
+            current_paragraph.append(line)
             continue
 
-        numbered_heading = re.match(r"^(\d+(?:\.\d+)*)\.\s+(.*)", line)
-        if numbered_heading:
+        if match.group("hash") is not None:
             flush_paragraph()
             flush_list()
-            depth = numbered_heading.group(1).count(".") + 1
-            text = numbered_heading.group(2).strip()
-            blocks.append({"type": "heading", "level": min(depth, 5), "text": text})
+            level = len(match.group("hash"))
+            text = match.group("h_text").strip()
+            blocks.append(MarkdownBlock(kind="heading", level=min(level, 5), text=text))
             continue
 
-        ordered_item = re.match(r"^\s*(\d+)[.)]\s+(.*)", line)
-        if ordered_item:
-            if current_list is None or current_list.get("type") != "ordered_list":
-                flush_paragraph()
-                flush_list()
-                current_list = {"type": "ordered_list", "items": []}
-            current_list["items"].append(ordered_item.group(2).strip())
+        if match.group("num") is not None:
+            flush_paragraph()
+            flush_list()
+            depth = match.group("num").count(".") + 1
+            text = match.group("n_text").strip()
+            blocks.append(MarkdownBlock(kind="heading", level=min(depth, 5), text=text))
             continue
 
-        bullet_item = re.match(r"^\s*[-*+]\s+(.*)", line)
-        if bullet_item:
-            if current_list is None or current_list.get("type") != "bullet_list":
+        if match.group("ol_text") is not None:
+            if current_list is None or current_list.kind != "ordered_list":
                 flush_paragraph()
                 flush_list()
-                current_list = {"type": "bullet_list", "items": []}
-            current_list["items"].append(bullet_item.group(1).strip())
+                current_list = MarkdownBlock(kind="ordered_list")
+            current_list.items.append(match.group("ol_text").strip())
             continue
 
-        current_paragraph.append(line)
+        if current_list is None or current_list.kind != "bullet_list":
+            flush_paragraph()
+            flush_list()
+            current_list = MarkdownBlock(kind="bullet_list")
+        current_list.items.append(match.group("ul_text").strip())
 
     flush_paragraph()
     flush_list()
     return blocks
 
 
-def _blocks_to_html(blocks: list[dict[str, object]]) -> str:
+def _blocks_to_html(blocks: list[MarkdownBlock]) -> str:
     parts: list[str] = []
+    table = _HTML_ESCAPE_TABLE
 
     for block in blocks:
-        if block.get("type") == "heading":
-            level = int(block.get("level", 1))
-            text = html.escape(str(block.get("text", "")))
-            level = max(1, min(level, 6))
+        kind = block.kind
+        if kind == "heading":
+            level = max(1, min(block.level, 6))
+            text = block.text.translate(table)
             parts.append(f"<h{level}>{text}</h{level}>")
             continue
 
-        if block.get("type") == "ordered_list":
-            items = "".join(
-                f"<li>{html.escape(str(item))}</li>" for item in block.get("items", [])
-            )
+        if kind == "ordered_list":
+            items = "".join(f"<li>{item.translate(table)}</li>" for item in block.items)
             parts.append(f"<ol>{items}</ol>")
             continue
 
-        if block.get("type") == "bullet_list":
-            items = "".join(
-                f"<li>{html.escape(str(item))}</li>" for item in block.get("items", [])
-            )
+        if kind == "bullet_list":
+            items = "".join(f"<li>{item.translate(table)}</li>" for item in block.items)
             parts.append(f"<ul>{items}</ul>")
             continue
 
-        text = html.escape(str(block.get("text", "")))
+        text = block.text.translate(table)
         if text:
             parts.append(f"<p>{text}</p>")
 
     return "\n".join(parts)
 
 
-def _ensure_heading_numbering(document: Document) -> int:
+def _ensure_heading_numbering(document: DocxDocument) -> int:
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
     numbering_part = document.part.numbering_part
     numbering = numbering_part.numbering_definitions._numbering
 
@@ -1094,6 +1629,9 @@ def _ensure_heading_numbering(document: Document) -> int:
 
 
 def _attach_numbering(paragraph, num_id: int, level: int) -> None:
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
     num_pr = OxmlElement("w:numPr")
     ilvl = OxmlElement("w:ilvl")
     ilvl.set(qn("w:val"), str(max(0, level)))
@@ -1104,31 +1642,31 @@ def _attach_numbering(paragraph, num_id: int, level: int) -> None:
     paragraph._p.get_or_add_pPr().append(num_pr)
 
 
-def _render_docx_from_blocks(blocks: list[dict[str, object]]) -> io.BytesIO:
+def _render_docx_from_blocks(blocks: list[MarkdownBlock]) -> io.BytesIO:
+    from docx import Document
+
     document = Document()
     numbering_id = _ensure_heading_numbering(document)
 
     for block in blocks or []:
-        if block.get("type") == "heading":
-            level = int(block.get("level", 1))
-            style_level = max(1, min(level, 5))
-            paragraph = document.add_paragraph(
-                str(block.get("text", "")), style=f"Heading {style_level}"
-            )
+        kind = block.kind
+        if kind == "heading":
+            style_level = max(1, min(block.level, 5))
+            paragraph = document.add_paragraph(block.text, style=f"Heading {style_level}")
             _attach_numbering(paragraph, numbering_id, style_level - 1)
             continue
 
-        if block.get("type") == "ordered_list":
-            for item in block.get("items", []):
-                document.add_paragraph(str(item), style="List Number")
+        if kind == "ordered_list":
+            for item in block.items:
+                document.add_paragraph(item, style="List Number")
             continue
 
-        if block.get("type") == "bullet_list":
-            for item in block.get("items", []):
-                document.add_paragraph(str(item), style="List Bullet")
+        if kind == "bullet_list":
+            for item in block.items:
+                document.add_paragraph(item, style="List Bullet")
             continue
 
-        document.add_paragraph(str(block.get("text", "")))
+        document.add_paragraph(block.text)
 
     buffer = io.BytesIO()
     document.save(buffer)
@@ -1136,253 +1674,439 @@ def _render_docx_from_blocks(blocks: list[dict[str, object]]) -> io.BytesIO:
     return buffer
 
 
-def _find_block_node(node: NavigableString) -> Tag | None:
-    current = node.parent
-    while current is not None:
-        if isinstance(current, Tag) and current.name in {
-            "p",
-            "li",
-            "td",
-            "th",
-            "caption",
-            "blockquote",
-            "h1",
-            "h2",
-            "h3",
-            "h4",
-            "h5",
-            "h6",
-            "pre",
-            "code",
-            "div",
-        }:
+def _find_block_node(
+    element: etree._Element, root: etree._Element
+) -> etree._Element | None:
+    current: etree._Element | None = element
+    while current is not None and current is not root:
+        if current.tag in BLOCK_TAG_NAMES:
             return current
-        current = current.parent
+        current = current.getparent()
     return None
 
 
 def _summarize_location(
-    soup: BeautifulSoup,
     node_infos: list[dict[str, object]],
+    node_starts: list[int],
     start_index: int,
+    element_texts: dict[etree._Element, str],
 ) -> DiffLocation | None:
-    if not node_infos:
+    # 文本节点的 token 区间首尾相接且升序，二分找到起点不超过 start_index 的最后一个节点：
+    # 区间内即为所在节点，越过末尾时即为最后一个节点（与原先的逐个回退查找一致）
+    position = bisect_right(node_starts, start_index) - 1
+    if position < 0:
         return None
+    target_info = node_infos[position]
 
-    target_info: dict[str, object] | None = None
-    for info in node_infos:
-        if info["start"] <= start_index < info["end"]:
-            target_info = info
-            break
-
-    if target_info is None and start_index > 0:
-        backtrack_index = start_index - 1
-        for info in node_infos:
-            if info["start"] <= backtrack_index < info["end"]:
-                target_info = info
-                break
-
-    if target_info is None:
-        for info in reversed(node_infos):
-            if info["start"] <= start_index:
-                target_info = info
-                break
-
-    if target_info is None:
-        return None
+    # 同一文本节点的多处差异共享定位结果
+    if "location" in target_info:
+        return target_info["location"]
+    location = _locate_text_node(target_info, element_texts)
+    target_info["location"] = location
+    return location
 
-    node = target_info["node"]
-    if not isinstance(node, NavigableString):
-        return None
 
-    block = _find_block_node(node)
+def _locate_text_node(
+    info: dict[str, object], element_texts: dict[etree._Element, str]
+) -> DiffLocation | None:
+    block: etree._Element | None = info["block"]
     block_summary: str | None = None
     if block is not None:
-        text = block.get_text(" ", strip=True)
+        text = _cached_element_text(block, element_texts)
         if text:
             block_summary = _truncate_text(text)
 
-    heading: Tag | None = None
-    search_anchor: Tag | None = block if block is not None else node.parent
-    heading_tags = ["h1", "h2", "h3", "h4", "h5", "h6"]
-    if search_anchor is not None:
-        heading = search_anchor if isinstance(search_anchor, Tag) and search_anchor.name in heading_tags else search_anchor.find_previous(heading_tags)
-    else:
-        heading = soup.find(heading_tags)
-
+    heading: etree._Element | None = info["heading"]
     section_title: str | None = None
     if heading is not None:
-        section_text = heading.get_text(" ", strip=True)
+        section_text = _cached_element_text(heading, element_texts)
         if section_text:
             section_title = _truncate_text(section_text, 60)
 
     if section_title is None and block_summary is None:
         return None
 
-    return DiffLocation(section_title=section_title, block_summary=block_summary)
+    return DiffLocation.model_construct(section_title=section_title, block_summary=block_summary)
 
 
-def _build_highlight_lookup(highlights: list[dict[str, object]]) -> dict[int, dict[str, object]]:
-    lookup: dict[int, dict[str, object]] = {}
-    for entry in highlights:
-        start = entry["start"]
-        end = entry["end"]
-        for index in range(start, end):
-            lookup[index] = entry
-    return lookup
+@dataclass(slots=True)
+class HighlightEntry:
+    id: str
+    type: str
+    role: str
+    start: int
+    end: int
+    label: str
+    number: int
+    placeholder: bool = False
+    # 同一差异片段可能跨多个文本节点，标记模板只构建一次，之后复制即可
+    template: etree._Element | None = None
+
+
+def _build_highlight_lookup(
+    highlights: list[HighlightEntry],
+) -> tuple[list[int], list[int], list[HighlightEntry]]:
+    """Return span highlights as parallel (starts, ends, entries) lists sorted by start."""
+
+    entries = sorted(highlights, key=attrgetter("start"))
+    starts = [entry.start for entry in entries]
+    ends = [entry.end for entry in entries]
+    return starts, ends, entries
+
+
+def _create_marker_tag(entry: HighlightEntry, text: str) -> etree._Element:
+    template = entry.template
+    if template is None:
+        template = entry.template = _build_marker_template(entry)
+    mark = copy.copy(template)
+    mark.text = text
+    return mark
 
 
-def _create_marker_tag(
-    soup: BeautifulSoup, entry: dict[str, object], text: str
-) -> Tag:
-    mark = soup.new_tag("span")
+def _build_marker_template(entry: HighlightEntry) -> etree._Element:
+    mark = etree.Element("span")
     classes = [
         "diff-marker",
-        f'diff-marker--{entry["type"]}',
-        f'diff-marker--{entry["role"]}',
+        f"diff-marker--{entry.type}",
+        f"diff-marker--{entry.role}",
     ]
-    if entry.get("placeholder"):
+    if entry.placeholder:
         classes.append("diff-marker--placeholder")
     else:
         classes.append("diff-marker--with-pill")
-    mark["class"] = classes
-    mark["data-diff-id"] = entry["id"]
-    mark["data-diff-type"] = entry["type"]
-    mark["data-diff-role"] = entry["role"]
-
-    label = entry.get("label")
-    number = entry.get("number")
-    if label:
-        mark["data-diff-type-label"] = label
-    if number is not None:
-        mark["data-diff-number"] = str(number)
-    if label and number is not None:
-        mark["title"] = f"{label} #{number}"
-    if entry.get("placeholder"):
-        mark["data-diff-placeholder"] = "true"
-
-    mark.string = text
+    attributes = {
+        "class": " ".join(classes),
+        "data-diff-id": entry.id,
+        "data-diff-type": entry.type,
+        "data-diff-role": entry.role,
+        "data-diff-number": str(entry.number),
+    }
+    if entry.label:
+        attributes["data-diff-type-label"] = entry.label
+        attributes["title"] = f"{entry.label} #{entry.number}"
+    if entry.placeholder:
+        attributes["data-diff-placeholder"] = "true"
+
+    # 属性按名称排序输出，与此前 BeautifulSoup 序列化结果保持一致
+    for name in sorted(attributes):
+        mark.set(name, attributes[name])
     return mark
 
 
+def _splice_fragments(
+    info: dict[str, object], fragments: list[str | etree._Element]
+) -> None:
+    """Replace the text slot described by ``info`` with ``fragments``."""
+
+    leading_parts: list[str] = []
+    marks: list[etree._Element] = []
+    tails: list[list[str]] = []
+    for fragment in fragments:
+        if isinstance(fragment, str):
+            (tails[-1] if marks else leading_parts).append(fragment)
+        else:
+            marks.append(fragment)
+            tails.append([])
+
+    element: etree._Element = info["element"]
+    leading = "".join(leading_parts) or None
+    if info["slot"] == "text":
+        element.text = leading
+        for position, mark in enumerate(marks):
+            element.insert(position, mark)
+    else:
+        element.tail = leading
+        anchor = element
+        for mark in marks:
+            anchor.addnext(mark)
+            anchor = mark
+    for mark, tail_parts in zip(marks, tails):
+        mark.tail = "".join(tail_parts) or None
+
+
 def _apply_highlights(
-    soup: BeautifulSoup,
+    root: etree._Element,
     node_infos: list[dict[str, object]],
-    highlights: list[dict[str, object]],
+    highlights: list[HighlightEntry],
 ) -> str:
     if not highlights:
-        return str(soup)
+        return _serialize_html_fragment(root)
 
-    span_highlights: list[dict[str, object]] = []
-    boundary_highlights: dict[int, list[dict[str, object]]] = defaultdict(list)
+    span_highlights: list[HighlightEntry] = []
+    boundary_highlights: list[HighlightEntry] = []
 
     for entry in highlights:
-        start = int(entry.get("start", 0))
-        end = int(entry.get("end", start))
-        if end > start:
+        if entry.end > entry.start:
             span_highlights.append(entry)
         else:
-            boundary_highlights[start].append(entry)
+            boundary_highlights.append(entry)
+
+    span_starts, span_ends, span_entries = _build_highlight_lookup(span_highlights)
+    span_count = len(span_entries)
+    # 差异区间互不重叠且 token 按升序访问，游标只需单调前进
+    span_cursor = 0
+
+    # 占位标记按位置稳定排序后一次性分组，再用游标消费，逐 token 只需比较整数
+    start_of = attrgetter("start")
+    boundary_items = [
+        (position, list(group))
+        for position, group in groupby(sorted(boundary_highlights, key=start_of), key=start_of)
+    ]
+    boundary_count = len(boundary_items)
+    boundary_cursor = 0
+    next_boundary = boundary_items[0][0] if boundary_items else -1
+    unplaced_boundaries: list[HighlightEntry] = []
+
+    def take_boundaries(boundary_index: int) -> list[HighlightEntry]:
+        """Advance the boundary cursor to ``boundary_index`` and return the entries placed there."""
+
+        nonlocal boundary_cursor, next_boundary
+        placed: list[HighlightEntry] = []
+        while boundary_cursor < boundary_count and next_boundary <= boundary_index:
+            entries = boundary_items[boundary_cursor][1]
+            if next_boundary == boundary_index:
+                placed.extend(entries)
+            else:
+                unplaced_boundaries.extend(entries)
+            boundary_cursor += 1
+            next_boundary = (
+                boundary_items[boundary_cursor][0] if boundary_cursor < boundary_count else -1
+            )
+        return placed
+
+    for info in node_infos:
+        tokens = info["tokens"]
+        start_index = info["start"]
+        fragments: list[str | etree._Element] = []
+        append_fragment = fragments.append
+
+        if 0 <= next_boundary <= start_index:
+            for boundary_entry in take_boundaries(start_index):
+                append_fragment(_create_marker_tag(boundary_entry, "\u00a0"))
+
+        # 按区间跳跃：每段连续 token 的终点取当前高亮区间边界、节点末尾与下一个占位位置中的最近者，
+        # 整段切片输出，循环次数与片段数而非 token 数成正比
+        position = start_index
+        node_end = start_index + len(tokens)
+        while position < node_end:
+            while span_cursor < span_count and span_ends[span_cursor] <= position:
+                span_cursor += 1
+            if span_cursor < span_count and span_starts[span_cursor] <= position:
+                entry = span_entries[span_cursor]
+                run_end = min(span_ends[span_cursor], node_end)
+            else:
+                entry = None
+                run_end = min(span_starts[span_cursor], node_end) if span_cursor < span_count else node_end
+
+            placed: list[HighlightEntry] = []
+            if 0 <= next_boundary <= run_end:
+                # 节点起点之前的占位均已消费，此处 next_boundary 必然大于 position
+                run_end = next_boundary
+                placed = take_boundaries(run_end)
+
+            text = "".join(tokens[position - start_index : run_end - start_index])
+            append_fragment(_create_marker_tag(entry, text) if entry else text)
+            for boundary_entry in placed:
+                append_fragment(_create_marker_tag(boundary_entry, "\u00a0"))
+            position = run_end
+
+        _splice_fragments(info, fragments)
+
+    for _, entries in boundary_items[boundary_cursor:]:
+        unplaced_boundaries.extend(entries)
+    if unplaced_boundaries:
+        fallback_parent: etree._Element = node_infos[-1]["parent"] if node_infos else root
+
+        for entry in unplaced_boundaries:
+            fallback_parent.append(_create_marker_tag(entry, "\u00a0"))
+
+    return _serialize_html_fragment(root)
+
 
-    lookup = _build_highlight_lookup(span_highlights)
+def _block_token_ranges(node_infos: list[dict[str, object]]) -> list[tuple[int, int]]:
+    """Group consecutive text nodes sharing a block element into token ranges."""
 
+    ranges: list[tuple[int, int]] = []
+    current_anchor: object = None
     for info in node_infos:
-        node = info["node"]
-        parent = node.parent
-        if parent is None:
+        anchor = info["block"] if info["block"] is not None else info["parent"]
+        if ranges and anchor is current_anchor:
+            ranges[-1] = (ranges[-1][0], info["end"])  # type: ignore[assignment]
+        else:
+            ranges.append((info["start"], info["end"]))  # type: ignore[arg-type]
+            current_anchor = anchor
+    return ranges
+
+
+def _sequence_opcodes(
+    original: Sequence[Hashable], modified: Sequence[Hashable]
+) -> list[tuple[str, int, int, int, int]]:
+    """LCS opcodes from rapidfuzz, with adjacent insert/delete runs merged into ``replace``."""
+
+    # Indel 求的是最长公共子序列，与 difflib 的 SequenceMatcher（最长连续匹配块）并不等价：
+    # 文本内容不变，但插入/删除的对齐位置与 DiffStats 计数可能与旧实现不同
+    opcodes: list[tuple[str, int, int, int, int]] = []
+    for tag, i1, i2, j1, j2 in Indel.opcodes(original, modified):
+        if tag != "equal" and opcodes and opcodes[-1][0] != "equal":
+            # Indel 不产生替换操作，相邻的删除与插入合并为一个 replace 片段
+            _, start_i, _, start_j, _ = opcodes[-1]
+            merged_tag = "replace" if start_i != i2 and start_j != j2 else tag
+            opcodes[-1] = (merged_tag, start_i, i2, start_j, j2)
+        else:
+            opcodes.append((tag, i1, i2, j1, j2))
+    return opcodes
+
+
+def _encode_token_ids(
+    original_tokens: list[str], modified_tokens: list[str]
+) -> tuple[Sequence[Hashable], Sequence[Hashable]]:
+    """Map tokens to shared integer ids, packed as code points so rapidfuzz compares raw integers."""
+
+    vocab: dict[str, int] = {}
+    original_ids = [vocab.setdefault(token, len(vocab)) for token in original_tokens]
+    modified_ids = [vocab.setdefault(token, len(vocab)) for token in modified_tokens]
+    if len(vocab) > sys.maxunicode:  # pragma: no cover - 词表超出码位范围时退回整数列表
+        return original_ids, modified_ids
+    return "".join(map(chr, original_ids)), "".join(map(chr, modified_ids))
+
+
+def _diff_opcodes(
+    original_tokens: list[str],
+    original_ranges: list[tuple[int, int]],
+    modified_tokens: list[str],
+    modified_ranges: list[tuple[int, int]],
+) -> list[tuple[str, int, int, int, int]]:
+    """先按段落对齐，只对有改动的段落区间做逐词比较，避免长文档上的平方级匹配。"""
+
+    original_codes, modified_codes = _encode_token_ids(original_tokens, modified_tokens)
+    original_blocks = [original_codes[start:end] for start, end in original_ranges]
+    modified_blocks = [modified_codes[start:end] for start, end in modified_ranges]
+
+    def token_offset(ranges: list[tuple[int, int]], block_index: int, total: int) -> int:
+        return ranges[block_index][0] if block_index < len(ranges) else total
+
+    opcodes: list[tuple[str, int, int, int, int]] = []
+    for tag, b1, b2, c1, c2 in _sequence_opcodes(original_blocks, modified_blocks):
+        i1 = token_offset(original_ranges, b1, len(original_tokens))
+        i2 = token_offset(original_ranges, b2, len(original_tokens))
+        j1 = token_offset(modified_ranges, c1, len(modified_tokens))
+        j2 = token_offset(modified_ranges, c2, len(modified_tokens))
+        if tag == "equal" or i1 == i2 or j1 == j2:
+            opcodes.append((tag, i1, i2, j1, j2))
             continue
 
-        tokens = info["tokens"]
-        start_index = info["start"]
-        end_index = info["end"]
+        opcodes.extend(
+            (sub_tag, i1 + s1, i1 + s2, j1 + t1, j1 + t2)
+            for sub_tag, s1, s2, t1, t2 in _sequence_opcodes(
+                original_codes[i1:i2], modified_codes[j1:j2]
+            )
+        )
+    return opcodes
 
-        current_entry: dict[str, object] | None = None
-        buffer: list[str] = []
-        fragments: list[object] = []
 
-        def emit_boundary(boundary_index: int) -> None:
-            entries = boundary_highlights.pop(boundary_index, None)
-            if not entries:
-                return
-            flush()
-            for boundary_entry in entries:
-                fragments.append(
-                    _create_marker_tag(soup, boundary_entry, "\u00a0")
-                )
+def _diff_etag(original_key: bytes, modified_key: bytes, include_highlighted: bool) -> str:
+    # 两个上传摘要均为定长 16 字节，直接拼接不会产生边界歧义
+    digest = hashlib.blake2b(original_key, digest_size=16)
+    digest.update(modified_key)
+    digest.update(b"1" if include_highlighted else b"0")
+    return f'"{digest.hexdigest()}"'
 
-        def flush() -> None:
-            nonlocal buffer, current_entry
-            if not buffer:
-                return
-            text = "".join(buffer)
-            if current_entry:
-                fragments.append(_create_marker_tag(soup, current_entry, text))
-            else:
-                fragments.append(text)
-            buffer = []
-
-        emit_boundary(start_index)
-        for offset, token in enumerate(tokens):
-            absolute_index = start_index + offset
-            entry = lookup.get(absolute_index)
-            if entry is not current_entry:
-                flush()
-                current_entry = entry
-            buffer.append(token)
-            emit_boundary(absolute_index + 1)
-
-        flush()
-        emit_boundary(end_index)
-
-        for fragment in fragments:
-            node.insert_before(fragment)
-
-        node.extract()
-
-    if boundary_highlights:
-        fallback_parent: Tag | None = None
-        if node_infos:
-            fallback_parent = node_infos[-1]["node"].parent
-        if fallback_parent is None:
-            fallback_parent = soup.body or soup
-
-        for boundary_index in sorted(boundary_highlights.keys()):
-            entries = boundary_highlights[boundary_index]
-            for entry in entries:
-                fallback_parent.append(
-                    _create_marker_tag(soup, entry, "\u00a0")
-                )
 
-    return str(soup)
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison against an ``If-None-Match`` list, honouring ``*``."""
+
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
 
+# 差异标签的固定片段，逐段写入 diff_parts，最终统一 join
+_DIFF_INSERT_OPEN = '<ins class="diff-insert" data-diff-id="'
+_DIFF_INSERT_CLOSE = "</ins>"
+_DIFF_DELETE_OPEN = '<del class="diff-delete" data-diff-id="'
+_DIFF_DELETE_CLOSE = "</del>"
+_DIFF_TAG_MID = '">'
 
-def _build_diff(
-    original_html: str, modified_html: str
-) -> tuple[str, DiffStats, list[DiffItem], str, str]:
-    from difflib import SequenceMatcher
 
+@dataclass(slots=True)
+class DiffBuildResult:
+    diff_html: str
+    stats: DiffStats
+    diff_items: list[DiffItem]
+    original_html: str
+    modified_html: str
+
+
+async def _build_diff(
+    original_html: str, modified_html: str, include_highlighted: bool = True
+) -> DiffBuildResult:
+    if original_html == modified_html:
+        # 两份 HTML 完全相同时只需解析一次，两侧输出共用同一份序列化结果
+        root, _, _, escaped = await asyncio.to_thread(_prepare_html_tokens, original_html)
+        serialized = _serialize_html_fragment(root)
+        return DiffBuildResult(
+            diff_html="".join(escaped),
+            stats=DiffStats(inserted_tokens=0, deleted_tokens=0, replaced_tokens=0),
+            diff_items=[],
+            original_html=serialized,
+            modified_html=serialized,
+        )
+
+    # 解析、比对与高亮均为 CPU 密集操作，放到线程池执行，避免阻塞事件循环
     (
-        original_soup,
+        (
+            original_root,
+            original_tokens,
+            original_node_infos,
+            original_escaped,
+        ),
+        (
+            modified_root,
+            modified_tokens,
+            modified_node_infos,
+            modified_escaped,
+        ),
+    ) = await asyncio.gather(
+        asyncio.to_thread(_prepare_html_tokens, original_html),
+        asyncio.to_thread(_prepare_html_tokens, modified_html),
+    )
+
+    if len(original_tokens) == len(modified_tokens) and original_tokens == modified_tokens:
+        # 文本 token 完全一致时无需比对，结果等同于单个 equal 片段
+        return DiffBuildResult(
+            diff_html="".join(original_escaped),
+            stats=DiffStats(inserted_tokens=0, deleted_tokens=0, replaced_tokens=0),
+            diff_items=[],
+            original_html=_serialize_html_fragment(original_root),
+            modified_html=_serialize_html_fragment(modified_root),
+        )
+
+    opcodes = await asyncio.to_thread(
+        _diff_opcodes,
         original_tokens,
-        original_node_infos,
-    ) = _prepare_html_tokens(original_html)
-    (
-        modified_soup,
+        _block_token_ranges(original_node_infos),
         modified_tokens,
-        modified_node_infos,
-    ) = _prepare_html_tokens(modified_html)
+        _block_token_ranges(modified_node_infos),
+    )
 
-    matcher = SequenceMatcher(None, original_tokens, modified_tokens)
+    original_node_starts = [info["start"] for info in original_node_infos]
+    modified_node_starts = [info["start"] for info in modified_node_infos]
+    # 同一段落或章节标题下的多处差异复用已提取的元素文本
+    element_texts: dict[etree._Element, str] = {}
 
     diff_parts: list[str] = []
     inserted_tokens = deleted_tokens = replaced_tokens = 0
     diff_items: list[DiffItem] = []
-    highlight_map = {"original": [], "modified": []}
+    highlight_map: dict[str, list[HighlightEntry]] = {"original": [], "modified": []}
     diff_index = 1
 
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == "equal":
-            diff_parts.append(_escape_tokens(original_tokens[i1:i2]))
+            diff_parts.extend(original_escaped[i1:i2])
         elif tag == "insert":
             if j1 == j2:
                 continue
@@ -1391,15 +2115,14 @@ def _build_diff(
             diff_index += 1
             inserted_tokens += j2 - j1
             inserted_raw = "".join(modified_tokens[j1:j2])
-            inserted_escaped = _escape_tokens(modified_tokens[j1:j2])
             modified_location = _summarize_location(
-                modified_soup, modified_node_infos, j1
-            )
-            diff_parts.append(
-                f'<ins class="diff-insert" data-diff-id="{diff_id}">{inserted_escaped}</ins>'
+                modified_node_infos, modified_node_starts, j1, element_texts
             )
+            diff_parts.extend((_DIFF_INSERT_OPEN, diff_id, _DIFF_TAG_MID))
+            diff_parts.extend(modified_escaped[j1:j2])
+            diff_parts.append(_DIFF_INSERT_CLOSE)
             diff_items.append(
-                DiffItem(
+                DiffItem.model_construct(
                     id=diff_id,
                     type="insert",
                     original_text="",
@@ -1408,27 +2131,27 @@ def _build_diff(
                 )
             )
             highlight_map["original"].append(
-                {
-                    "id": diff_id,
-                    "type": "insert",
-                    "role": "original",
-                    "start": i1,
-                    "end": i1,
-                    "label": DIFF_TYPE_LABELS["insert"],
-                    "number": diff_number,
-                    "placeholder": True,
-                }
+                HighlightEntry(
+                    id=diff_id,
+                    type="insert",
+                    role="original",
+                    start=i1,
+                    end=i1,
+                    label=DIFF_TYPE_LABELS["insert"],
+                    number=diff_number,
+                    placeholder=True,
+                )
             )
             highlight_map["modified"].append(
-                {
-                    "id": diff_id,
-                    "type": "insert",
-                    "role": "modified",
-                    "start": j1,
-                    "end": j2,
-                    "label": DIFF_TYPE_LABELS["insert"],
-                    "number": diff_number,
-                }
+                HighlightEntry(
+                    id=diff_id,
+                    type="insert",
+                    role="modified",
+                    start=j1,
+                    end=j2,
+                    label=DIFF_TYPE_LABELS["insert"],
+                    number=diff_number,
+                )
             )
         elif tag == "delete":
             if i1 == i2:
@@ -1438,21 +2161,23 @@ def _build_diff(
             diff_index += 1
             deleted_tokens += i2 - i1
             deleted_raw = "".join(original_tokens[i1:i2])
-            deleted_escaped = _escape_tokens(original_tokens[i1:i2])
             original_location = _summarize_location(
-                original_soup, original_node_infos, i1
+                original_node_infos, original_node_starts, i1, element_texts
             )
             # 在 modified 中找到对应的位置（删除后应该插入占位符的位置）
             # 由于是删除，modified 中对应的位置是 j1（等于 i1 在原始序列中的位置）
             # 但我们需要在 modified 的对应位置插入占位符
             modified_location = _summarize_location(
-                modified_soup, modified_node_infos, j1 if j1 < len(modified_tokens) else max(0, len(modified_tokens) - 1)
-            )
-            diff_parts.append(
-                f'<del class="diff-delete" data-diff-id="{diff_id}">{deleted_escaped}</del>'
+                modified_node_infos,
+                modified_node_starts,
+                j1 if j1 < len(modified_tokens) else max(0, len(modified_tokens) - 1),
+                element_texts,
             )
+            diff_parts.extend((_DIFF_DELETE_OPEN, diff_id, _DIFF_TAG_MID))
+            diff_parts.extend(original_escaped[i1:i2])
+            diff_parts.append(_DIFF_DELETE_CLOSE)
             diff_items.append(
-                DiffItem(
+                DiffItem.model_construct(
                     id=diff_id,
                     type="delete",
                     original_text=deleted_raw,
@@ -1462,28 +2187,28 @@ def _build_diff(
                 )
             )
             highlight_map["original"].append(
-                {
-                    "id": diff_id,
-                    "type": "delete",
-                    "role": "original",
-                    "start": i1,
-                    "end": i2,
-                    "label": DIFF_TYPE_LABELS["delete"],
-                    "number": diff_number,
-                }
+                HighlightEntry(
+                    id=diff_id,
+                    type="delete",
+                    role="original",
+                    start=i1,
+                    end=i2,
+                    label=DIFF_TYPE_LABELS["delete"],
+                    number=diff_number,
+                )
             )
             # 在 modified 中添加占位符标记
             highlight_map["modified"].append(
-                {
-                    "id": diff_id,
-                    "type": "delete",
-                    "role": "modified",
-                    "start": j1,
-                    "end": j1,
-                    "label": DIFF_TYPE_LABELS["delete"],
-                    "number": diff_number,
-                    "placeholder": True,
-                }
+                HighlightEntry(
+                    id=diff_id,
+                    type="delete",
+                    role="modified",
+                    start=j1,
+                    end=j1,
+                    label=DIFF_TYPE_LABELS["delete"],
+                    number=diff_number,
+                    placeholder=True,
+                )
             )
         elif tag == "replace":
             if i1 == i2 and j1 == j2:
@@ -1493,49 +2218,47 @@ def _build_diff(
             diff_index += 1
             removed_raw = "".join(original_tokens[i1:i2])
             added_raw = "".join(modified_tokens[j1:j2])
-            removed_escaped = _escape_tokens(original_tokens[i1:i2])
-            added_escaped = _escape_tokens(modified_tokens[j1:j2])
             original_location = _summarize_location(
-                original_soup, original_node_infos, i1
+                original_node_infos, original_node_starts, i1, element_texts
             )
             modified_location = _summarize_location(
-                modified_soup, modified_node_infos, j1
+                modified_node_infos, modified_node_starts, j1, element_texts
             )
 
             if i1 != i2:
-                diff_parts.append(
-                    f'<del class="diff-delete" data-diff-id="{diff_id}">{removed_escaped}</del>'
-                )
+                diff_parts.extend((_DIFF_DELETE_OPEN, diff_id, _DIFF_TAG_MID))
+                diff_parts.extend(original_escaped[i1:i2])
+                diff_parts.append(_DIFF_DELETE_CLOSE)
                 highlight_map["original"].append(
-                    {
-                        "id": diff_id,
-                        "type": "replace",
-                        "role": "original",
-                        "start": i1,
-                        "end": i2,
-                        "label": DIFF_TYPE_LABELS["replace"],
-                        "number": diff_number,
-                    }
+                    HighlightEntry(
+                        id=diff_id,
+                        type="replace",
+                        role="original",
+                        start=i1,
+                        end=i2,
+                        label=DIFF_TYPE_LABELS["replace"],
+                        number=diff_number,
+                    )
                 )
             if j1 != j2:
-                diff_parts.append(
-                    f'<ins class="diff-insert" data-diff-id="{diff_id}">{added_escaped}</ins>'
-                )
+                diff_parts.extend((_DIFF_INSERT_OPEN, diff_id, _DIFF_TAG_MID))
+                diff_parts.extend(modified_escaped[j1:j2])
+                diff_parts.append(_DIFF_INSERT_CLOSE)
                 highlight_map["modified"].append(
-                    {
-                        "id": diff_id,
-                        "type": "replace",
-                        "role": "modified",
-                        "start": j1,
-                        "end": j2,
-                        "label": DIFF_TYPE_LABELS["replace"],
-                        "number": diff_number,
-                    }
+                    HighlightEntry(
+                        id=diff_id,
+                        type="replace",
+                        role="modified",
+                        start=j1,
+                        end=j2,
+                        label=DIFF_TYPE_LABELS["replace"],
+                        number=diff_number,
+                    )
                 )
 
             replaced_tokens += max(i2 - i1, j2 - j1)
             diff_items.append(
-                DiffItem(
+                DiffItem.model_construct(
                     id=diff_id,
                     type="replace",
                     original_text=removed_raw,
@@ -1551,35 +2274,63 @@ def _build_diff(
         deleted_tokens=deleted_tokens,
         replaced_tokens=replaced_tokens,
     )
-    highlighted_original = _apply_highlights(
-        original_soup, original_node_infos, highlight_map["original"]
-    )
-    highlighted_modified = _apply_highlights(
-        modified_soup, modified_node_infos, highlight_map["modified"]
+    if not include_highlighted:
+        # 调用方只需要差异列表时跳过两侧的高亮标记
+        return DiffBuildResult(
+            diff_html=diff_html,
+            stats=stats,
+            diff_items=diff_items,
+            original_html=_serialize_html_fragment(original_root),
+            modified_html=_serialize_html_fragment(modified_root),
+        )
+
+    highlighted_original, highlighted_modified = await asyncio.gather(
+        asyncio.to_thread(
+            _apply_highlights, original_root, original_node_infos, highlight_map["original"]
+        ),
+        asyncio.to_thread(
+            _apply_highlights, modified_root, modified_node_infos, highlight_map["modified"]
+        ),
     )
 
-    return diff_html, stats, diff_items, highlighted_original, highlighted_modified
+    return DiffBuildResult(
+        diff_html=diff_html,
+        stats=stats,
+        diff_items=diff_items,
+        original_html=highlighted_original,
+        modified_html=highlighted_modified,
+    )
 
 
 @app.post("/api/contract/desensitize", response_model=DesensitizeResponse)
 async def desensitize_contract(
-    file: Annotated[UploadFile, File(description="合同 .doc/.docx 文件")]
-) -> DesensitizeResponse:
+    file: Annotated[UploadFile, File(description="合同 .doc/.docx 文件")],
+    envelope: bool = False,
+) -> DesensitizeResponse | Response:
+    """Return the sanitized .docx as an attachment, or the JSON envelope when ``envelope=1``."""
+
     raw_bytes, filename = await _read_word_file_bytes(file)
     plain_text = _collect_docx_text(raw_bytes)
     hits = _find_sensitive_hits(plain_text)
 
     mask_map = {hit.value: _mask_value(hit.value) for hit in hits if hit.value}
-    sanitized_bytes = _sanitize_docx_bytes(raw_bytes, mask_map)
-    sanitized_preview = _mask_text_with_map(plain_text, mask_map) if plain_text else None
-
-    encoded_file = base64.b64encode(sanitized_bytes).decode("utf-8")
+    sanitized_buffer = _sanitize_docx_bytes(raw_bytes, mask_map)
     safe_name = _sanitize_filename(filename.rsplit(".", 1)[0]) or "合同"
+    download_name = f"{safe_name}_脱敏.docx"
+    total_hits = sum(hit.count for hit in hits)
+
+    if not envelope:
+        response = _build_stream_response(sanitized_buffer, DOCX_MEDIA_TYPE, download_name)
+        response.headers["X-Sanitized-Hits"] = str(total_hits)
+        return response
+
+    sanitized_preview = _mask_text_with_map(plain_text, mask_map) if plain_text else None
+    encoded_file = base64.b64encode(sanitized_buffer.getbuffer()).decode("utf-8")
 
     return DesensitizeResponse(
         sanitized_docx=encoded_file,
-        filename=f"{safe_name}_脱敏.docx",
-        total_hits=sum(hit.count for hit in hits),
+        filename=download_name,
+        total_hits=total_hits,
         hits=hits,
         sanitized_preview=sanitized_preview,
     )
@@ -1595,6 +2346,8 @@ async def convert_word(
 
 @app.post("/diff", response_model=DiffResponse)
 async def diff_word_documents(
+    request: Request,
+    response: Response,
     original_file: Annotated[
         UploadFile,
         File(description="Original .docx file", alias="original"),
@@ -1603,36 +2356,51 @@ async def diff_word_documents(
         UploadFile,
         File(description="Modified .docx file", alias="modified"),
     ],
-) -> DiffResponse:
-    original_html, original_notes = await _convert_to_html(original_file)
-    modified_html, modified_notes = await _convert_to_html(modified_file)
+    include_highlighted: bool = True,
+) -> DiffResponse | Response:
+    """``include_highlighted=0`` skips the side-by-side markers; repeat requests honour ``If-None-Match``."""
 
-    diff_html, stats, diff_items, highlighted_original, highlighted_modified = _build_diff(
-        original_html, modified_html
+    original_key, modified_key = await asyncio.gather(
+        _checked_upload_digest(original_file), _checked_upload_digest(modified_file)
     )
 
+    # ETag 只依赖上传内容摘要，条件请求命中时无需转换文档
+    etag = _diff_etag(original_key, modified_key, include_highlighted)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = _diff_result_cache.get(etag)
+    if cached is None:
+        (original_html, original_notes), (modified_html, modified_notes) = await asyncio.gather(
+            _convert_to_html(original_file, original_key),
+            _convert_to_html(modified_file, modified_key),
+        )
+        result = await _build_diff(original_html, modified_html, include_highlighted)
+        cached = (result, original_notes, modified_notes)
+        _diff_result_cache.put(etag, cached)
+    result, original_notes, modified_notes = cached
+
+    response.headers["ETag"] = etag
     return DiffResponse(
-        original_html=highlighted_original or "<p>未检测到正文内容。</p>",
-        modified_html=highlighted_modified or "<p>未检测到正文内容。</p>",
-        diff_html=diff_html or "<p>未检测到差异。</p>",
-        stats=stats,
-        diff_items=diff_items,
+        original_html=result.original_html or "<p>未检测到正文内容。</p>",
+        modified_html=result.modified_html or "<p>未检测到正文内容。</p>",
+        diff_html=result.diff_html or "<p>未检测到差异。</p>",
+        stats=result.stats,
+        diff_items=result.diff_items,
         original_notes=original_notes,
         modified_notes=modified_notes,
     )
 
 
 @app.post("/export")
-async def export_document(request: ExportRequest) -> StreamingResponse:
+async def export_document(request: ExportRequest) -> Response:
     format_name = request.format.lower()
     filename = _sanitize_filename(request.filename)
     html_content = request.content or ""
 
     if format_name == "docx":
         buffer = _render_docx_document(html_content)
-        media_type = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        )
+        media_type = DOCX_MEDIA_TYPE
         extension = "docx"
     elif format_name == "pdf":
         buffer = _render_pdf_document(html_content)
@@ -1646,8 +2414,7 @@ async def export_document(request: ExportRequest) -> StreamingResponse:
         raise HTTPException(status_code=400, detail="Unsupported export format")
 
     download_name = f"{filename}.{extension}"
-    data = buffer.getvalue()
-    return _build_file_response(data, media_type, download_name)
+    return _build_stream_response(buffer, media_type, download_name)
 
 
 @app.post("/api/ai/transform")
@@ -1674,16 +2441,15 @@ def ai_transform(request: AiTransformRequest) -> dict[str, str]:
 
 
 @app.post("/api/export/docx")
-def export_docx(payload: MarkdownPayload) -> StreamingResponse:
+def export_docx(payload: MarkdownPayload) -> Response:
     blocks = _markdown_to_blocks(payload.markdown)
     html_content = _blocks_to_html(blocks)
     buffer = _render_docx_from_blocks(blocks)
 
     filename = _sanitize_filename("合同AI导出") + ".docx"
-    data = buffer.getvalue()
-    return _build_file_response(
-        data,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    return _build_stream_response(
+        buffer,
+        media_type=DOCX_MEDIA_TYPE,
         filename=filename,
     )
 
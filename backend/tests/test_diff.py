@@ -0,0 +1,115 @@
+import asyncio
+import io
+
+from docx import Document
+from fastapi.testclient import TestClient
+
+from app.main import _build_diff, _sequence_opcodes, app
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def _diff(original_html: str, modified_html: str):
+    return asyncio.run(_build_diff(original_html, modified_html))
+
+
+def _docx_bytes(*paragraphs: str) -> bytes:
+    document = Document()
+    for text in paragraphs:
+        document.add_paragraph(text)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def test_identical_input_has_no_diff():
+    result = _diff("<p>甲方应支付款项。</p>", "<p>甲方应支付款项。</p>")
+
+    assert result.stats.model_dump() == {
+        "inserted_tokens": 0,
+        "deleted_tokens": 0,
+        "replaced_tokens": 0,
+    }
+    assert result.diff_items == []
+    assert result.diff_html == "甲方应支付款项。"
+
+
+def test_pure_insert():
+    result = _diff("<p>甲方应支付款项。</p>", "<p>甲方应按时支付款项。</p>")
+
+    assert result.stats.model_dump() == {
+        "inserted_tokens": 2,
+        "deleted_tokens": 0,
+        "replaced_tokens": 0,
+    }
+    assert [(item.type, item.original_text, item.modified_text) for item in result.diff_items] == [
+        ("insert", "", "按时")
+    ]
+    assert result.diff_html == (
+        '甲方应<ins class="diff-insert" data-diff-id="diff-1">按时</ins>支付款项。'
+    )
+
+
+def test_pure_delete():
+    result = _diff("<p>甲方应按时支付款项。</p>", "<p>甲方应支付款项。</p>")
+
+    assert result.stats.model_dump() == {
+        "inserted_tokens": 0,
+        "deleted_tokens": 2,
+        "replaced_tokens": 0,
+    }
+    assert [(item.type, item.original_text, item.modified_text) for item in result.diff_items] == [
+        ("delete", "按时", "")
+    ]
+    assert result.diff_html == (
+        '甲方应<del class="diff-delete" data-diff-id="diff-1">按时</del>支付款项。'
+    )
+
+
+def test_adjacent_delete_and_insert_merge_into_replace():
+    assert _sequence_opcodes("abc", "axc") == [
+        ("equal", 0, 1, 0, 1),
+        ("replace", 1, 2, 1, 2),
+        ("equal", 2, 3, 2, 3),
+    ]
+    assert _sequence_opcodes("ab", "cd") == [("replace", 0, 2, 0, 2)]
+
+    result = _diff("<p>甲方应支付款项。</p>", "<p>乙方应收取款项。</p>")
+
+    assert result.stats.model_dump() == {
+        "inserted_tokens": 0,
+        "deleted_tokens": 0,
+        "replaced_tokens": 3,
+    }
+    assert [(item.type, item.original_text, item.modified_text) for item in result.diff_items] == [
+        ("replace", "甲", "乙"),
+        ("replace", "支付", "收取"),
+    ]
+
+
+def test_matching_etag_returns_not_modified():
+    client = TestClient(app)
+    original = _docx_bytes("甲方应支付款项。")
+    modified = _docx_bytes("甲方应按时支付款项。")
+
+    def post(headers: dict[str, str] | None = None):
+        return client.post(
+            "/diff",
+            files={
+                "original": ("original.docx", original, DOCX_MIME),
+                "modified": ("modified.docx", modified, DOCX_MIME),
+            },
+            headers=headers,
+        )
+
+    first = post()
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = post({"If-None-Match": header})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    assert post({"If-None-Match": '"other"'}).status_code == 200
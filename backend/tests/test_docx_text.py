@@ -0,0 +1,88 @@
+import io
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.opc.constants import RELATIONSHIP_TYPE
+
+from app.main import _extract_docx_text, _find_sensitive_hits
+
+
+def _build_contract() -> bytes:
+    document = Document()
+    document.add_paragraph("甲方：深圳某某科技有限公司")
+
+    paragraph = document.add_paragraph()
+    paragraph.add_run("编号\t第一条")
+    paragraph.add_run("付款").add_break()
+    paragraph.add_run("第二条")
+
+    paragraph = document.add_paragraph("官网：")
+    hyperlink = OxmlElement("w:hyperlink")
+    hyperlink.set(
+        qn("r:id"),
+        document.part.relate_to("https://example.com", RELATIONSHIP_TYPE.HYPERLINK, is_external=True),
+    )
+    run = OxmlElement("w:r")
+    text = OxmlElement("w:t")
+    text.text = "联系邮箱 alice@example.com"
+    run.append(text)
+    hyperlink.append(run)
+    paragraph._p.append(hyperlink)
+
+    table = document.add_table(rows=3, cols=3)
+    table.cell(0, 0).text = "名称"
+    table.cell(0, 1).merge(table.cell(0, 2)).text = "深圳某某科技有限公司"
+    table.cell(1, 0).text = "地址"
+    table.cell(1, 1).text = "深圳市南山区科技南路18号"
+    table.cell(1, 2).merge(table.cell(2, 2)).text = "备注"
+    table.cell(2, 0).text = "电话"
+    table.cell(2, 1).text = "13800138000"
+
+    document.add_paragraph("表后段落")
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def test_extract_docx_text_matches_python_docx_order():
+    raw_bytes = _build_contract()
+
+    text = _extract_docx_text(raw_bytes)
+
+    # 先输出全部正文段落（含制表符、换行与超链接文本），再输出表格单元格；
+    # 合并单元格只输出一次（python-docx 的 row.cells 会对合并范围内的每个网格单元重复返回）
+    assert text == "\n".join(
+        [
+            "甲方：深圳某某科技有限公司",
+            "编号\t第一条付款\n第二条",
+            "官网：联系邮箱 alice@example.com",
+            "表后段落",
+            "名称",
+            "深圳某某科技有限公司",
+            "地址",
+            "深圳市南山区科技南路18号",
+            "备注",
+            "电话",
+            "13800138000",
+        ]
+    )
+
+    document = Document(io.BytesIO(raw_bytes))
+    paragraph_texts = [paragraph.text for paragraph in document.paragraphs if paragraph.text]
+    assert text.startswith("\n".join(paragraph_texts) + "\n")
+
+
+def test_merged_cells_are_counted_once():
+    hits = {
+        (hit.field, hit.value): hit.count
+        for hit in _find_sensitive_hits(_extract_docx_text(_build_contract()))
+    }
+
+    # python-docx 会把合并单元格重复输出，旧实现因此分别计为 3 次和 2 次
+    assert hits[("企业名称", "深圳某某科技有限公司")] == 2
+    assert hits[("人名", "备注")] == 1
+    assert hits[("地址", "深圳市南山区科技南路18号")] == 1
+    assert hits[("联系电话", "13800138000")] == 1
+    assert hits[("邮箱", "alice@example.com")] == 1
@@ -0,0 +1,80 @@
+from app.main import _find_sensitive_hits, _mask_text_with_map, _mask_value
+
+
+def _masked(text: str) -> str:
+    hits = _find_sensitive_hits(text)
+    return _mask_text_with_map(text, {hit.value: _mask_value(hit.value) for hit in hits})
+
+
+def _values(text: str, field: str) -> list[str]:
+    return sorted(hit.value for hit in _find_sensitive_hits(text) if hit.field == field)
+
+
+def test_long_company_name_is_fully_masked():
+    name = "某" * 80 + "科技有限公司"
+    text = f"甲方：{name}。"
+
+    assert _values(text, "企业名称") == [name]
+    assert "某" not in _masked(text)
+
+
+def test_companies_in_one_run_are_masked_together():
+    text = "甲方：深圳某某科技有限公司乙方北京某某数据服务有限公司。"
+
+    assert _values(text, "企业名称") == ["深圳某某科技有限公司乙方北京某某数据服务有限公司"]
+    assert "某" not in _masked(text)
+
+
+def test_long_address_is_fully_masked():
+    address = "某" * 90 + "路88号A座"
+    text = f"住所：{address}。"
+
+    assert _values(text, "地址") == [address]
+    assert "某" not in _masked(text)
+
+
+def test_second_address_in_one_run_is_masked():
+    # 第一个地址的 {2,40} 尾部停在字符段中间，其后的第二个地址仍须从该位置继续匹配
+    text = (
+        "乙方住所：深圳市南山区科技南路18号（深圳湾科技生态园）二期十栋A座三十一层整层及三十二层"
+        "东侧办公区域以及配套的员工餐厅和会议中心联络处北京市朝阳区建国路88号华贸中心"
+    )
+
+    assert _values(text, "地址") == [
+        "深圳市南山区科技南路18号（深圳湾科技生态园）二期十栋A座三十一层整层及三十二层东侧办公区域以及配套的员工",
+        "餐厅和会议中心联络处北京市朝阳区建国路88号华贸中心",
+    ]
+    masked = _masked(text)
+    assert "北京市朝阳区" not in masked
+    assert "华贸中心" not in masked
+
+
+def test_long_bank_name_is_fully_masked():
+    bank = "某" * 70 + "银行" + "某" * 70 + "支行"
+    text = f"开户行：{bank}。"
+
+    assert _values(text, "开户银行") == [bank]
+    assert "某" not in _masked(text)
+
+
+def test_banks_in_one_run_are_masked_together():
+    text = "开户行：中国工商银行深圳分行招商银行南山支行。"
+
+    assert _values(text, "开户银行") == ["中国工商银行深圳分行招商银行南山支行"]
+
+
+def test_long_email_local_part_is_fully_masked():
+    email = "a" * 70 + "@example.com"
+    text = f"邮箱：{email}。"
+
+    assert _values(text, "邮箱") == [email]
+    assert "a" not in _masked(text)
+
+
+def test_adjacent_emails_are_both_masked():
+    text = "联系：alice@example.com1bob@example.org；"
+
+    assert _values(text, "邮箱") == ["1bob@example.org", "alice@example.com"]
+    masked = _masked(text)
+    assert "alice" not in masked
+    assert "bob" not in masked
@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+from app.main import _format_sse, app
+
+
+def test_format_sse_frame_bytes():
+    # 帧以空行 (\n\n) 结尾；修改分帧格式会影响所有现有的编辑器流客户端
+    assert (
+        _format_sse(payload={"text": "甲\n乙"}, event="chunk", event_id="req1:1")
+        == 'id: req1:1\nevent: chunk\ndata: {"text":"甲\\n乙"}\n\n'.encode("utf-8")
+    )
+    assert _format_sse(payload={"a": 1}) == b'data: {"a":1}\n\n'
+
+
+def test_editor_stream_bytes():
+    client = TestClient(app)
+    response = client.get(
+        "/ai/editor/stream",
+        params={"action": "rewrite", "text": "甲方应支付款项。", "request_id": "req1", "chunk_delay": 0},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.content == (
+        "retry: 3000\n\n"
+        "id: req1:0\nevent: start\n"
+        'data: {"requestId":"req1","action":"rewrite","receivedText":"甲方应支付款项。","instruction":""}\n\n'
+        "id: req1:1\nevent: chunk\n"
+        'data: {"requestId":"req1","content":"经优化表述：甲方应支付款项。","index":1,"total":1}\n\n'
+        "id: req1:2\nevent: done\n"
+        'data: {"requestId":"req1","status":"completed","result":"经优化表述：甲方应支付款项。",'
+        '"totalChunks":1,"meta":{"instruction":""}}\n\n'
+    ).encode("utf-8")
+
+
+def test_editor_stream_bytes_for_empty_text():
+    client = TestClient(app)
+    response = client.get(
+        "/ai/editor/stream",
+        params={"action": "rewrite", "text": "", "request_id": "req1", "chunk_delay": 0},
+    )
+
+    assert response.content == (
+        "retry: 3000\n\n"
+        "id: req1:0\nevent: start\n"
+        'data: {"requestId":"req1","action":"rewrite","receivedText":"","instruction":""}\n\n'
+        "id: req1:1\nevent: done\n"
+        'data: {"requestId":"req1","status":"empty","message":"请选择一段文本后再试。"}\n\n'
+    ).encode("utf-8")
@@ -69,7 +69,7 @@ export default function ContractDesensitize({ title, subtitle, apiBaseUrl }) {
       const formData = new FormData();
       formData.append("file", file);
 
-      const response = await fetch(`${apiBaseUrl}/api/contract/desensitize`, {
+      const response = await fetch(`${apiBaseUrl}/api/contract/desensitize?envelope=1`, {
         method: "POST",
         body: formData,
       });